@@ -0,0 +1,127 @@
+"""
+Runs the offline benchmarks and prints their results as JSON.
+
+Comparing against an earlier output lists every number that got worse by more than
+the threshold and exits with 1 if there is any. Rates (`*_per_s`) are better higher,
+everything else timed is better lower. Run from the repository root:
+    python -m benchmarks [name ...] [--output results.json] [--baseline old.json] [--threshold 20]
+"""
+
+import sys
+import json
+import time
+import argparse
+import platform
+import importlib
+import subprocess
+import traceback
+
+BENCHMARKS = ("song_queue", "volume_transform", "embeds", "database", "play")
+
+# Only these numbers are compared, the others are counts or settings of a benchmark
+TIMED_SUFFIXES = ("_us", "_ms", "_s", "_per_frame")
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(value, prefix: str = "") -> dict:
+    """Numbers of a result by their dotted path, results of lists are keyed by their `size` or `guilds`"""
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(flatten(item, f"{prefix}.{key}" if prefix else key))
+        return flat
+
+    if isinstance(value, list):
+        flat = {}
+        for index, item in enumerate(value):
+            label = index
+            if isinstance(item, dict):
+                label = item.get("size", item.get("guilds", index))
+            flat.update(flatten(item, f"{prefix}[{label}]"))
+        return flat
+
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+
+def regressions(baseline: dict, current: dict, threshold: float) -> list:
+    baseline, current = flatten(baseline["results"]), flatten(current["results"])
+
+    found = []
+    for key, new in current.items():
+        old = baseline.get(key)
+        name = key.rsplit(".", 1)[-1]
+        if not old or not name.endswith(TIMED_SUFFIXES):
+            continue
+
+        # Rates are better higher, so their change is turned around
+        change = (old - new) / old if name.endswith("_per_s") else (new - old) / old
+        if change * 100 > threshold:
+            found.append((key, old, new, change))
+
+    return found
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run, all by default: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--output", help="also write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=20, help="percent a number may get worse by")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    output = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": int(time.time()),
+        "durations": {},
+        "results": {},
+    }
+
+    for name in args.names or BENCHMARKS:
+        print(f"Running {name}...", file=sys.stderr)
+        start = time.perf_counter()
+        try:
+            result = importlib.import_module(f"benchmarks.{name}").run()
+        except Exception as e:
+            # A benchmark missing an optional dependency doesn't stop the others
+            traceback.print_exc()
+            result = {"error": f"{type(e).__name__}: {e}"}
+        output["durations"][name] = round(time.perf_counter() - start, 3)
+        output["results"][name] = result
+
+    text = json.dumps(output, indent=4)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+        found = regressions(baseline, output, args.threshold)
+        for key, old, new, change in found:
+            print(f"Regression {key}: {old} -> {new} ({change:+.0%})", file=sys.stderr)
+        if found:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+Write and read rates of the DatabaseConnector on a temporary database.
+
+Writes go through the same statements as the search index of the music cog.
+Run from the repository root, the schema and migrations are read from there:
+    python -m benchmarks.database
+"""
+
+import os
+import time
+import json
+import asyncio
+import tempfile
+
+from benchmarks.fakes import new_event_loop, percentile
+from camila.database import DatabaseConnector
+from cogs.music import SearchIndex
+
+WRITES = 5000
+AWAITED_WRITES = 50
+READS = 5000
+
+UPSERT = """INSERT INTO search_index (query, video_id, webpage_url, hits, last_used)
+VALUES (?, ?, ?, 0, ?)
+ON CONFLICT (query) DO UPDATE SET last_used = excluded.last_used"""
+
+
+def row(index: int) -> tuple:
+    return (f"query {index}", f"video{index}", f"https://www.youtube.com/watch?v=video{index}", index)
+
+
+async def barrier(db: DatabaseConnector):
+    """Writes are applied in order, so once this one is committed every earlier one is as well"""
+    await db.execute("SELECT 1")
+
+
+async def bench(path: str) -> dict:
+    db = DatabaseConnector()
+    await db.load_db(path, asyncio.get_event_loop())
+    result = {}
+
+    try:
+        # Many writers at once, their writes share transactions
+        start = time.perf_counter()
+        await asyncio.gather(*(db.execute(UPSERT, row(i)) for i in range(WRITES)))
+        result["concurrent_writes_per_s"] = round(WRITES / (time.perf_counter() - start), 1)
+
+        # A single writer waiting for each commit pays the flush interval every time
+        latencies = []
+        for i in range(AWAITED_WRITES):
+            start = time.perf_counter()
+            await db.execute(UPSERT, row(i))
+            latencies.append(time.perf_counter() - start)
+        result["awaited_write_p50_ms"] = round(percentile(latencies, 0.5) * 1000, 3)
+
+        start = time.perf_counter()
+        await db.executemany(UPSERT, (row(i) for i in range(WRITES, 2 * WRITES)))
+        result["executemany_rows_per_s"] = round(WRITES / (time.perf_counter() - start), 1)
+
+        # What !play does behind the scenes, an upsert and a trim of the index for every search
+        index = SearchIndex(maxsize=WRITES)
+        start = time.perf_counter()
+        for i in range(WRITES):
+            index.store(db, *row(i)[:3])
+        await barrier(db)
+        result["search_index_stores_per_s"] = round(WRITES / (time.perf_counter() - start), 1)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(index.lookup(db, f"query {i % WRITES}") for i in range(READS)))
+        await barrier(db)
+        result["search_index_lookups_per_s"] = round(READS / (time.perf_counter() - start), 1)
+
+        # Reads are served by the reader pool while the writer is busy
+        start = time.perf_counter()
+        reads = asyncio.gather(
+            *(db.fetchone("SELECT webpage_url FROM search_index WHERE query = ?", (f"query {i}",)) for i in range(READS))
+        )
+        writes = asyncio.gather(*(db.execute(UPSERT, row(i)) for i in range(WRITES)))
+        await asyncio.gather(reads, writes)
+        result["mixed_operations_per_s"] = round((READS + WRITES) / (time.perf_counter() - start), 1)
+    finally:
+        await db.close()
+
+    result["database_kib"] = round(os.path.getsize(path) / 1024, 1)
+    return result
+
+
+def run() -> dict:
+    loop = new_event_loop()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            result = loop.run_until_complete(bench(os.path.join(directory, "camila.sqlite")))
+    finally:
+        loop.close()
+
+    return {"writes": WRITES, "reads": READS, **result}
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=4))
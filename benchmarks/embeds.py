@@ -0,0 +1,86 @@
+"""
+Cost of building and serializing the embeds of the music commands.
+
+Run from the repository root:
+    python -m benchmarks.embeds
+"""
+
+import time
+import json
+import asyncio
+
+from discord.ext import commands
+
+from benchmarks.fakes import FakeContext, FakeGuild, load_fixtures, new_event_loop
+from cogs.music import Music, Song, VoiceState, YTDLSource
+
+QUEUE_SIZES = (10, 1000, 100000)
+RENDERS = 2000
+
+
+def measure(operation, count: int = RENDERS) -> float:
+    """Returns the mean cost of a single call in microseconds"""
+    start = time.perf_counter()
+    for _ in range(count):
+        operation()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+async def measure_async(operation, count: int = RENDERS) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        await operation()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+async def render_queues(music: Music, ctx: FakeContext, songs: list) -> list:
+    """The queue command at growing queue sizes, its embed is serialized by the fake channel.
+    The voice state is never started, nothing tries to play or refresh the queued songs"""
+    ctx.voice_state = VoiceState(music.bot, ctx.guild)
+    queue = ctx.voice_state.songs
+
+    results = []
+    for size in QUEUE_SIZES:
+        queue.clear()
+        for i in range(size):
+            queue.put_nowait(songs[i % len(songs)])
+
+        pages = -(-size // 10)
+        first = await measure_async(lambda: music.queue.callback(music, ctx, page=1))
+        last = await measure_async(lambda: music.queue.callback(music, ctx, page=pages))
+        ctx.channel.messages.clear()
+
+        results.append({"size": size, "first_page_us": round(first, 3), "last_page_us": round(last, 3)})
+
+    return results
+
+
+def run() -> dict:
+    loop = new_event_loop()
+    fixtures = load_fixtures()
+
+    bot = commands.Bot(command_prefix="!", loop=loop)
+    ctx = FakeContext(bot, FakeGuild(1))
+    songs = [Song(ctx, info) for info in fixtures["videos"].values()]
+
+    result = {
+        "renders": RENDERS,
+        "now_playing_us": round(measure(lambda: songs[0].create_embed()), 3),
+        "now_playing_serialized_us": round(measure(lambda: songs[0].create_embed().to_dict()), 3),
+    }
+
+    music = Music(bot)
+    try:
+        # The cog reads the audio cache in the background, the loop is closed right after the run
+        loop.run_until_complete(YTDLSource.audio_cache.load())
+        result["queue"] = loop.run_until_complete(render_queues(music, ctx, songs))
+    finally:
+        music.cog_unload()
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
+
+    return result
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=4))
@@ -0,0 +1,217 @@
+"""
+A local stand-in for the Discord API and gateway, enough for the bot to log in,
+identify its shards and receive their guilds. Every guild is sent to the shard
+owning it only, a shard connected twice at the same time is reported. Start it and
+point the bot at it, sharded or not:
+    python -m benchmarks.fakegateway --port 8765 --guilds 100 --shards 4
+    DISCORD_API_URL=http://127.0.0.1:8765/api/v7 DISCORD_BOT_TOKEN=fake python camila.py --workers 2
+GET /fake/shards lists the shards connected right now and how often each one identified.
+"""
+
+import json
+import asyncio
+import logging
+import argparse
+import itertools
+import collections
+
+from aiohttp import web, WSMsgType
+
+BOT_ID = 1000
+
+# Gateway opcodes
+DISPATCH = 0
+HEARTBEAT = 1
+IDENTIFY = 2
+RESUME = 6
+INVALID_SESSION = 9
+HELLO = 10
+HEARTBEAT_ACK = 11
+
+
+def respond(data: dict, status: int = 200) -> web.Response:
+    """discord.py only parses responses whose content type is exactly application/json, without a charset"""
+    return web.Response(body=json.dumps(data).encode(), status=status, headers={"Content-Type": "application/json"})
+
+
+def snowflake(index: int) -> int:
+    """IDs spread over every shard, like the real ones created over time"""
+    return ((1420070400000 + index * 7919) << 22) + index
+
+
+class FakeGateway:
+    """
+    Serves the REST routes the bot needs at startup and a gateway accepting any token.
+    Unknown REST routes answer with 404, the bot's requests after startup aren't faked.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, *, guilds: int = 10, shards: int = 1):
+        self.host = host
+        self.port = port
+        self.recommended_shards = shards
+        self.guilds = [snowflake(index) for index in range(1, guilds + 1)]
+
+        # Shard ID -> websockets currently identified as it
+        self.connected = collections.defaultdict(set)
+        self.identifies = collections.Counter()
+        self.duplicates = 0
+
+        self._sessions = itertools.count(1)
+        self._runner = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/api/v7/users/@me", self.current_user)
+        app.router.add_get("/api/v7/gateway", self.gateway)
+        app.router.add_get("/api/v7/gateway/bot", self.gateway_bot)
+        app.router.add_get("/gateway", self.websocket)
+        app.router.add_get("/fake/shards", self.shards)
+        app.router.add_route("*", "/{path:.*}", self.not_found)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info(f"Fake gateway listening on {self.url}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @staticmethod
+    def user() -> dict:
+        return {"id": str(BOT_ID), "username": "Camila", "discriminator": "0001", "avatar": None, "bot": True}
+
+    def guild(self, guild_id: int) -> dict:
+        return {
+            "id": str(guild_id),
+            "name": f"Guild {guild_id}",
+            "unavailable": False,
+            "owner_id": str(BOT_ID),
+            "member_count": 1,
+            "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0}],
+            "channels": [
+                {"id": str(guild_id + 1), "type": 0, "name": "general", "position": 0, "permission_overwrites": []},
+                {"id": str(guild_id + 2), "type": 2, "name": "Ogólny", "position": 1, "permission_overwrites": []},
+            ],
+            "members": [{"user": self.user(), "roles": [], "joined_at": "2020-01-01T00:00:00+00:00"}],
+            "voice_states": [],
+            "presences": [],
+            "emojis": [],
+            "features": [],
+        }
+
+    async def current_user(self, request):
+        return respond(self.user())
+
+    async def gateway(self, request):
+        return respond({"url": f"ws://{self.host}:{self.port}/gateway"})
+
+    async def gateway_bot(self, request):
+        return respond(
+            {
+                "url": f"ws://{self.host}:{self.port}/gateway",
+                "shards": self.recommended_shards,
+                "session_start_limit": {"total": 1000, "remaining": 1000, "reset_after": 0, "max_concurrency": 1},
+            }
+        )
+
+    async def shards(self, request):
+        return respond(
+            {
+                "connected": {shard_id: len(sockets) for shard_id, sockets in sorted(self.connected.items()) if sockets},
+                "identifies": dict(sorted(self.identifies.items())),
+                "duplicates": self.duplicates,
+            }
+        )
+
+    async def not_found(self, request):
+        return respond({"message": "Unknown route of the fake gateway", "code": 0}, status=404)
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        sequence = itertools.count(1)
+        shard_id = None
+
+        async def dispatch(event: str, data: dict):
+            await ws.send_str(json.dumps({"op": DISPATCH, "t": event, "s": next(sequence), "d": data}))
+
+        await ws.send_str(json.dumps({"op": HELLO, "d": {"heartbeat_interval": 41250}}))
+        try:
+            async for message in ws:
+                if message.type != WSMsgType.TEXT:
+                    continue
+
+                payload = json.loads(message.data)
+                op = payload.get("op")
+                if op == HEARTBEAT:
+                    await ws.send_str(json.dumps({"op": HEARTBEAT_ACK}))
+                elif op == RESUME:
+                    # Sessions aren't kept, the shard identifies again
+                    await ws.send_str(json.dumps({"op": INVALID_SESSION, "d": False}))
+                elif op == IDENTIFY:
+                    shard_id, shard_count = payload["d"].get("shard", [0, 1])
+                    self.identifies[shard_id] += 1
+                    self.connected[shard_id].add(ws)
+                    if len(self.connected[shard_id]) > 1:
+                        self.duplicates += 1
+                        logging.warning(f"Shard {shard_id} is connected {len(self.connected[shard_id])} times")
+                    logging.info(f"Shard {shard_id}/{shard_count} identified")
+
+                    owned = [guild_id for guild_id in self.guilds if (guild_id >> 22) % shard_count == shard_id]
+                    await dispatch(
+                        "READY",
+                        {
+                            "v": 6,
+                            "user": self.user(),
+                            "guilds": [{"id": str(guild_id), "unavailable": True} for guild_id in owned],
+                            "session_id": f"session{next(self._sessions)}",
+                            "shard": [shard_id, shard_count],
+                            "private_channels": [],
+                            "relationships": [],
+                            "application": {"id": str(BOT_ID), "flags": 0},
+                        },
+                    )
+                    for guild_id in owned:
+                        await dispatch("GUILD_CREATE", self.guild(guild_id))
+        finally:
+            if shard_id is not None:
+                self.connected[shard_id].discard(ws)
+                logging.info(f"Shard {shard_id} disconnected")
+
+        return ws
+
+
+async def serve(gateway: FakeGateway):
+    await gateway.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await gateway.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.fakegateway", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--guilds", type=int, default=10, help="guilds spread over the shards")
+    parser.add_argument("--shards", type=int, default=1, help="shard count recommended to the bot")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] fake gateway: %(message)s", datefmt="%H:%M:%S")
+    try:
+        asyncio.get_event_loop().run_until_complete(
+            serve(FakeGateway(args.host, args.port, guilds=args.guilds, shards=args.shards))
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
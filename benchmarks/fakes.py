@@ -0,0 +1,347 @@
+"""
+Offline stand-ins for YouTube and Discord, shared by the benchmarks.
+
+`RecordedExtractor` answers `YoutubeDL.extract_info` from the recorded fixtures and
+`ThreadedExtractionService` runs the real extraction code on threads, so it can be patched.
+`FakeVoiceClient` consumes frames like discord.py's audio player, at real time or faster.
+"""
+
+import copy
+import json
+import time
+import random
+import asyncio
+import threading
+import contextlib
+from types import SimpleNamespace
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import discord
+
+from camila import extraction
+from camila.audio import FRAME_LENGTH
+from camila.extraction import ExtractionService
+
+FIXTURES = Path(__file__).parent / "fixtures" / "extraction.json"
+
+
+def load_fixtures(path: Path = FIXTURES) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class RecordedExtractor:
+    """
+    Replays recorded `extract_info` responses with their recorded latency times `latency_scale`.
+    Searches missing from the fixtures are answered with recorded videos picked by the query,
+    so any query resolves the same way on every run.
+    """
+
+    def __init__(self, fixtures: dict, *, latency_scale: float = 0.1):
+        self.fixtures = fixtures
+        self.latency_scale = latency_scale
+        self.calls = {"flat": 0, "full": 0}
+
+        self._ids = {info["id"]: url for url, info in fixtures["videos"].items()}
+        self._lock = threading.Lock()
+
+    def _sleep(self, phase: str):
+        with self._lock:
+            self.calls[phase] += 1
+        time.sleep(self.fixtures["latency"][phase] * self.latency_scale)
+
+    def _video(self, url: str) -> dict:
+        info = copy.deepcopy(self.fixtures["videos"][url])
+        expire = f"expire={int(time.time()) + 6 * 3600}"
+        info["url"] = info["url"].replace("expire=0", expire)
+        for fmt in info["formats"]:
+            fmt["url"] = fmt["url"].replace("expire=0", expire)
+        return info
+
+    def _search(self, query: str) -> list:
+        ids = self.fixtures["searches"].get(query)
+        if ids is None:
+            ids = random.Random(query).sample(list(self._ids), 5)
+
+        entries = []
+        for video_id in ids:
+            info = self.fixtures["videos"][self._ids[video_id]]
+            entries.append(
+                {
+                    "_type": "url",
+                    "ie_key": "Youtube",
+                    "id": video_id,
+                    "url": video_id,
+                    "title": info["title"],
+                    "uploader": info["uploader"],
+                    "duration": info["duration"],
+                }
+            )
+        return entries
+
+    def extract_info(self, url: str, download: bool = True, process: bool = True, **kwargs):
+        from youtube_dl.utils import DownloadError
+
+        if url in self.fixtures["videos"]:
+            self._sleep("full" if process else "flat")
+            return self._video(url)
+
+        if "://" in url:
+            self._sleep("flat")
+            raise DownloadError(f"ERROR: Unsupported URL: {url}")
+
+        self._sleep("flat")
+        prefix, _, query = url.partition(":")
+        if not prefix.startswith("ytsearch"):
+            prefix, query = "ytsearch1", url
+        limit = int(prefix[len("ytsearch") :] or 1)
+
+        return {"_type": "playlist", "id": query, "title": query, "entries": self._search(query)[:limit]}
+
+    @contextlib.contextmanager
+    def patch(self):
+        """Replaces `YoutubeDL.extract_info` with the recorded responses"""
+        import youtube_dl
+
+        original = youtube_dl.YoutubeDL.extract_info
+        recorded = self
+
+        def extract_info(ytdl, url, download=True, process=True, **kwargs):
+            return recorded.extract_info(url, download, process, **kwargs)
+
+        youtube_dl.YoutubeDL.extract_info = extract_info
+        try:
+            yield self
+        finally:
+            youtube_dl.YoutubeDL.extract_info = original
+
+
+class ThreadedExtractionService(ExtractionService):
+    """
+    The extraction service with its workers on threads of this process, where a patched
+    `YoutubeDL` is visible. The threads share one YoutubeDL like a worker process would.
+    """
+
+    def _new_pool(self):
+        extraction._init_worker(self.options)
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="extraction")
+
+
+class FakeSource(discord.AudioSource):
+    """
+    A song of `frames` silent Opus frames, in place of the ffmpeg process
+    """
+
+    SILENCE = b"\xf8\xff\xfe"
+
+    def __init__(self, song, *, frames: int = 50):
+        self.song = song
+        self.frames = 0
+        self.length = frames
+        self.process = None
+
+    @property
+    def position(self):
+        return self.frames * FRAME_LENGTH
+
+    def read(self):
+        if self.frames >= self.length:
+            return b""
+        self.frames += 1
+        return self.SILENCE
+
+    def is_opus(self):
+        return True
+
+
+class FakeVoiceClient:
+    """
+    Plays sources on a thread like discord.py's audio player, pacing frames `speed` times
+    faster than real time. Frames read later than their deadline are counted as late.
+    """
+
+    def __init__(self, channel: "FakeVoiceChannel", *, speed: float = 1.0):
+        self.channel = channel
+        self.speed = speed
+
+        self.frames = 0
+        self.late_frames = 0
+        self.first_frame = None
+
+        self._connected = True
+        # Set once the current source ended, every played source gets its own
+        self._end = None
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+    def play(self, source: discord.AudioSource, *, after=None):
+        if self.is_playing() or self.is_paused():
+            raise discord.ClientException("Already playing audio.")
+
+        self._end = threading.Event()
+        self._resumed.set()
+        threading.Thread(target=self._run, args=(source, after, self._end), daemon=True).start()
+
+    def _run(self, source: discord.AudioSource, after, end: threading.Event):
+        delay = FRAME_LENGTH / self.speed
+        start = time.perf_counter()
+        played = 0
+
+        try:
+            while not end.is_set():
+                if not self._resumed.is_set():
+                    self._resumed.wait()
+                    start, played = time.perf_counter(), 0
+                    continue
+
+                data = source.read()
+                if not data:
+                    break
+
+                now = time.perf_counter()
+                if self.first_frame is None:
+                    self.first_frame = now
+                # A frame more than a frame behind its slot would be heard as a gap
+                if now > start + (played + 1) * delay:
+                    self.late_frames += 1
+                played += 1
+                self.frames += 1
+
+                time.sleep(max(0, start + played * delay - time.perf_counter()))
+        finally:
+            # Like discord.py, the player counts as stopped by the time `after` runs
+            end.set()
+            source.cleanup()
+            if after is not None:
+                after(None)
+
+    def is_playing(self):
+        return self._end is not None and not self._end.is_set() and self._resumed.is_set()
+
+    def is_paused(self):
+        return self._end is not None and not self._end.is_set() and not self._resumed.is_set()
+
+    def is_connected(self):
+        return self._connected
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def stop(self):
+        if self._end is not None:
+            self._end.set()
+        self._resumed.set()
+
+    async def move_to(self, channel: "FakeVoiceChannel"):
+        self.channel = channel
+
+    async def disconnect(self, *, force: bool = False):
+        self.stop()
+        self._connected = False
+
+
+class FakeMember:
+    def __init__(self, member_id: int, *, bot: bool = False, voice: "FakeVoiceChannel" = None):
+        self.id = member_id
+        self.bot = bot
+        self.name = f"member{member_id}"
+        self.mention = f"<@{member_id}>"
+        self.voice = SimpleNamespace(channel=voice) if voice else None
+
+    def __str__(self):
+        return self.name
+
+
+class FakeTextChannel:
+    """
+    Keeps every message sent to it with the time it was sent at
+    """
+
+    def __init__(self, channel_id: int, guild: "FakeGuild"):
+        self.id = channel_id
+        self.guild = guild
+        self.messages = []
+
+    async def send(self, content: str = None, *, embed: discord.Embed = None, **kwargs):
+        if embed is not None:
+            # Serializing is part of what sending an embed costs
+            embed.to_dict()
+        self.messages.append((time.perf_counter(), content, embed))
+
+    @contextlib.asynccontextmanager
+    async def typing(self):
+        yield
+
+
+class FakeVoiceChannel:
+    def __init__(self, channel_id: int, guild: "FakeGuild", *, speed: float = 1.0):
+        self.id = channel_id
+        self.guild = guild
+        self.speed = speed
+        self.members = []
+        self.voice_client = None
+
+    async def connect(self, **kwargs):
+        self.voice_client = FakeVoiceClient(self, speed=self.speed)
+        return self.voice_client
+
+
+class FakeGuild:
+    """
+    A guild with one text channel, one voice channel and a member listening in it
+    """
+
+    def __init__(self, guild_id: int, *, speed: float = 1.0):
+        self.id = guild_id
+        self.text_channel = FakeTextChannel(guild_id * 10 + 1, self)
+        self.voice_channel = FakeVoiceChannel(guild_id * 10 + 2, self, speed=speed)
+        self.member = FakeMember(guild_id * 10 + 3, voice=self.voice_channel)
+        self.voice_channel.members.append(self.member)
+        self.me = FakeMember(0, bot=True)
+
+
+class FakeContext:
+    """
+    Just enough of `commands.Context` for the music commands
+    """
+
+    def __init__(self, bot, guild: FakeGuild):
+        self.bot = bot
+        self.guild = guild
+        self.author = guild.member
+        self.channel = guild.text_channel
+        self.command_failed = False
+        # Replies to this command only, the channel also gets the player's messages
+        self.sent = []
+
+    @property
+    def voice_client(self):
+        return self.guild.voice_channel.voice_client
+
+    async def send(self, content: str = None, **kwargs):
+        self.sent.append(content)
+        return await self.channel.send(content, **kwargs)
+
+    def typing(self):
+        return self.channel.typing()
+
+    async def invoke(self, command, *args, **kwargs):
+        return await command.callback(command.cog, self, *args, **kwargs)
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def new_event_loop() -> asyncio.AbstractEventLoop:
+    # asyncio primitives bind to the current loop on older Pythons
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop
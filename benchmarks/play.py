@@ -0,0 +1,175 @@
+"""
+Throughput and latency of !play with many guilds playing at once, entirely offline.
+
+Extraction replays the recorded fixtures with their latency scaled by LATENCY_SCALE,
+the voice clients consume SONG_FRAMES long songs SPEED times faster than real time
+and the ffmpeg source is replaced with silent frames. Run from the repository root:
+    python -m benchmarks.play
+"""
+
+import time
+import json
+import asyncio
+import tempfile
+
+from discord.ext import commands
+
+from benchmarks.fakes import (
+    FakeContext,
+    FakeGuild,
+    FakeSource,
+    RecordedExtractor,
+    ThreadedExtractionService,
+    load_fixtures,
+    new_event_loop,
+    percentile,
+)
+from camila.audiocache import OpusCache
+from camila.constants import (
+    EXTRACTION_WORKERS,
+    EXTRACTION_TIMEOUT,
+    EXTRACTION_MAX_JOBS,
+    SCHEDULER_PER_GUILD,
+    SCHEDULER_MAX_PENDING,
+)
+from camila.scheduler import RequestScheduler
+from cogs.music import ExtractionCache, Music, VoiceState, YTDLSource
+
+GUILDS = (1, 10, 50)
+PLAYS_PER_GUILD = 4
+LATENCY_SCALE = 0.1
+SPEED = 4
+SONG_FRAMES = 50
+# Playback is expected to be long over by then
+PLAYBACK_TIMEOUT = 60
+
+
+def milliseconds(seconds) -> float:
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def reset_music(cache_path: str):
+    """Fresh class level services of the music cog, so every run starts cold"""
+    YTDLSource.extractor = ThreadedExtractionService(
+        YTDLSource.YTDL_OPTIONS,
+        workers=EXTRACTION_WORKERS,
+        timeout=EXTRACTION_TIMEOUT,
+        max_jobs=EXTRACTION_MAX_JOBS,
+    )
+    YTDLSource.scheduler = RequestScheduler(
+        concurrency=EXTRACTION_WORKERS,
+        per_guild=SCHEDULER_PER_GUILD,
+        max_pending=SCHEDULER_MAX_PENDING,
+    )
+    YTDLSource.cache = ExtractionCache(maxsize=256)
+    # Nothing is played often enough to be transcoded, there is no ffmpeg to do it
+    YTDLSource.audio_cache = OpusCache(cache_path, budget=0, min_plays=10 ** 9)
+
+
+async def play_session(music: Music, guild: FakeGuild, queries: list, latencies: list, outcomes: list):
+    """Plays the queries one after another, like a member of the guild would"""
+    for query in queries:
+        ctx = FakeContext(music.bot, guild)
+        await music.cog_before_invoke(ctx)
+
+        start = time.perf_counter()
+        await music.play.callback(music, ctx, search=query)
+        elapsed = time.perf_counter() - start
+
+        accepted = any(reply and reply.startswith("Dodano do kolejki") for reply in ctx.sent)
+        outcomes.append(accepted)
+        if accepted:
+            latencies.append(elapsed)
+
+
+async def wait_for_playback(music: Music, timeout: float):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if all(state.is_idle for state in music.voice_states.values()):
+            return True
+        await asyncio.sleep(0.01)
+    return False
+
+
+async def run_guilds(count: int, fixtures: dict, cache_path: str) -> dict:
+    reset_music(cache_path)
+    recorded = RecordedExtractor(fixtures, latency_scale=LATENCY_SCALE)
+
+    bot = commands.Bot(command_prefix="!", loop=asyncio.get_event_loop())
+    bot.db_holder = None
+    music = Music(bot)
+    # The cog reads the cache directory in the background, a run must not close the loop before that
+    await YTDLSource.audio_cache.load()
+
+    searches = list(fixtures["searches"])
+    guilds = [FakeGuild(guild_id, speed=SPEED) for guild_id in range(1, count + 1)]
+    latencies, outcomes = [], []
+
+    with recorded.patch():
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(
+                play_session(
+                    music,
+                    guild,
+                    [searches[(guild.id + i) % len(searches)] for i in range(PLAYS_PER_GUILD)],
+                    latencies,
+                    outcomes,
+                )
+                for guild in guilds
+            )
+        )
+        queued = time.perf_counter() - start
+        finished = await wait_for_playback(music, PLAYBACK_TIMEOUT)
+
+    clients = [guild.voice_channel.voice_client for guild in guilds if guild.voice_channel.voice_client]
+    first_frames = [client.first_frame - start for client in clients if client.first_frame is not None]
+
+    music.cog_unload()
+    # Lets the players closed by unloading disconnect
+    await asyncio.sleep(0.05)
+
+    return {
+        "guilds": count,
+        "plays": len(outcomes),
+        "accepted": sum(outcomes),
+        "rejected": len(outcomes) - sum(outcomes),
+        "queue_s": round(queued, 3),
+        "plays_per_s": round(sum(outcomes) / queued, 3),
+        "play_p50_ms": milliseconds(percentile(latencies, 0.5)),
+        "play_p95_ms": milliseconds(percentile(latencies, 0.95)),
+        "play_max_ms": milliseconds(max(latencies, default=None)),
+        "first_frame_p50_ms": milliseconds(percentile(first_frames, 0.5)),
+        "first_frame_p95_ms": milliseconds(percentile(first_frames, 0.95)),
+        "frames": sum(client.frames for client in clients),
+        "late_frames": sum(client.late_frames for client in clients),
+        "flat_extractions": recorded.calls["flat"],
+        "full_extractions": recorded.calls["full"],
+        "finished": finished,
+    }
+
+
+def run() -> dict:
+    loop = new_event_loop()
+    fixtures = load_fixtures()
+
+    create_source = VoiceState.create_source
+    VoiceState.create_source = lambda state, song: FakeSource(song, frames=SONG_FRAMES)
+    try:
+        with tempfile.TemporaryDirectory() as cache_path:
+            results = [loop.run_until_complete(run_guilds(count, fixtures, cache_path)) for count in GUILDS]
+    finally:
+        VoiceState.create_source = create_source
+        loop.close()
+
+    return {
+        "plays_per_guild": PLAYS_PER_GUILD,
+        "latency_scale": LATENCY_SCALE,
+        "speed": SPEED,
+        "song_frames": SONG_FRAMES,
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=4))
@@ -0,0 +1,94 @@
+"""
+Per-operation cost of the song queue at growing sizes.
+
+Positional operations should grow logarithmically, so the cost at 100k entries
+should stay close to the cost at 1k. Run from the repository root:
+    python -m benchmarks.song_queue
+"""
+
+import time
+import json
+import random
+import asyncio
+from types import SimpleNamespace
+
+from cogs.music import SongQueue
+
+SIZES = (1000, 10000, 100000)
+OPERATIONS = 2000
+
+
+def fake_song(index: int, requesters: int = 10) -> SimpleNamespace:
+    # Every video is queued twice, so dedupe has work to do
+    return SimpleNamespace(id=f"video{index // 2}", requester=SimpleNamespace(id=index % requesters))
+
+
+def filled_queue(size: int) -> SongQueue:
+    songs = SongQueue()
+    for i in range(size):
+        songs.put_nowait(fake_song(i))
+    return songs
+
+
+def measure(operation, count: int = OPERATIONS) -> float:
+    """Returns the mean cost of a single call in microseconds"""
+    start = time.perf_counter()
+    for _ in range(count):
+        operation()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def run_size(size: int) -> dict:
+    songs = filled_queue(size)
+
+    def random_access():
+        songs[random.randrange(len(songs))]
+
+    def move():
+        songs.move(random.randrange(len(songs)), random.randrange(len(songs)))
+
+    def remove_and_put():
+        songs.remove(random.randrange(len(songs)))
+        songs.put_nowait(fake_song(random.randrange(size)))
+
+    def get_and_put():
+        songs.put_nowait(songs.get_nowait())
+
+    result = {
+        "size": size,
+        "index_us": round(measure(random_access), 3),
+        "move_us": round(measure(move), 3),
+        "remove_us": round(measure(remove_and_put), 3),
+        "get_put_us": round(measure(get_and_put), 3),
+    }
+
+    # Bulk operations run once over the whole queue
+    start = time.perf_counter()
+    songs.shuffle()
+    result["shuffle_ms"] = round((time.perf_counter() - start) * 1e3, 3)
+
+    start = time.perf_counter()
+    removed = songs.dedupe()
+    result["dedupe_ms"] = round((time.perf_counter() - start) * 1e3, 3)
+    result["dedupe_removed"] = removed
+
+    start = time.perf_counter()
+    removed = songs.remove_where(lambda song: song.requester.id == 0)
+    result["remove_requester_ms"] = round((time.perf_counter() - start) * 1e3, 3)
+    result["remove_requester_removed"] = removed
+
+    assert len(songs) == len(list(songs))
+    assert all(song.requester.id != 0 for song in songs)
+    assert len({song.id for song in songs}) == len(songs)
+    return result
+
+
+def run() -> dict:
+    # asyncio.Queue binds to the current loop on older Pythons
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    random.seed(0)
+    return {"operations": OPERATIONS, "results": [run_size(size) for size in SIZES]}
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=4))
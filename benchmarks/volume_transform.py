@@ -0,0 +1,99 @@
+"""
+Per-frame cost of the PCM volume transformers.
+
+Run from the repository root:
+    python -m benchmarks.volume_transform
+"""
+
+import time
+import json
+import random
+import struct
+import warnings
+
+import discord
+
+from camila.audio import NormalizingVolumeTransformer
+
+FRAMES = 20000
+ROUNDS = 5
+
+
+class LoopingPCM(discord.AudioSource):
+    """Endless PCM source cycling through a few pre-generated frames"""
+
+    def __init__(self, frames: int = 50, *, amplitude: int = 32767):
+        samples = discord.opus.Encoder.FRAME_SIZE // 2
+        self._frames = [
+            struct.pack(f"{samples}h", *(random.randint(-amplitude, amplitude) for _ in range(samples)))
+            for _ in range(frames)
+        ]
+        self._index = 0
+
+    def read(self):
+        self._index = (self._index + 1) % len(self._frames)
+        return self._frames[self._index]
+
+
+def measure(source: discord.AudioSource, frames: int = FRAMES, rounds: int = ROUNDS) -> float:
+    """Returns the cost of a single read in microseconds, the best mean of a few rounds is the least disturbed one"""
+    read = source.read
+    for _ in range(100):
+        read()
+
+    per_round = frames // rounds
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(per_round):
+            read()
+        elapsed = (time.perf_counter() - start) / per_round * 1e6
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def changing_volume(transformer: discord.AudioSource, volumes: tuple = (0.3, 0.6)) -> discord.AudioSource:
+    """Changes the volume before every read, so every frame is ramped"""
+    read = transformer.read
+
+    def read_with_volume_change():
+        transformer.volume = volumes[0] if transformer.volume != volumes[0] else volumes[1]
+        return read()
+
+    transformer.read = read_with_volume_change
+    return transformer
+
+
+def run() -> dict:
+    baseline = measure(LoopingPCM())
+    results = {"frames": FRAMES}
+
+    # Quiet tracks get a gain above 1.0, which needs clipping
+    cases = {
+        "": (LoopingPCM, 0.5),
+        "clipping_": (lambda: LoopingPCM(amplitude=1000), 2.0),
+    }
+    with warnings.catch_warnings():
+        # audioop is deprecated on newer Pythons, but it is what discord.py uses
+        warnings.simplefilter("ignore", DeprecationWarning)
+
+        for name, (source, volume) in cases.items():
+            audioop = measure(discord.PCMVolumeTransformer(source(), volume))
+            # The stock transformer takes the volume as is, the normalizing one applies the track gain on top
+            numpy = NormalizingVolumeTransformer(source(), volume)
+            numpy.read()
+            numpy.volume = volume / numpy.track_gain if name else volume
+
+            results[f"audioop_{name}us_per_frame"] = round(audioop - baseline, 3)
+            results[f"numpy_{name}us_per_frame"] = round(measure(numpy) - baseline, 3)
+
+        audioop = measure(changing_volume(discord.PCMVolumeTransformer(LoopingPCM(), 0.5)))
+    ramp = measure(changing_volume(NormalizingVolumeTransformer(LoopingPCM(), 0.5)))
+
+    results["audioop_ramp_us_per_frame"] = round(audioop - baseline, 3)
+    results["numpy_ramp_us_per_frame"] = round(ramp - baseline, 3)
+    return results
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=4))
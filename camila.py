@@ -1,9 +1,18 @@
 #!/usr/bin/env python3
 
+import time
+
+STARTED = time.perf_counter()
+
 import os
+import ast
 import sys
 import random
+import asyncio
+import argparse
 import logging
+import importlib
+import contextlib
 from traceback import format_exc
 
 try:
@@ -17,10 +26,14 @@ except ImportError:
 
 from camila.constants import *
 from camila.database import DatabaseConnector
+from camila.metrics import registry as metrics
+from camila.supervisor import Supervisor, recommended_shards
+
+LOG_FORMAT = "[%(asctime)s] {%(pathname)s:%(lineno)d} %(levelname)s: %(message)s"
 
 logging.basicConfig(
     level=logging.INFO,
-    format="[%(asctime)s] {%(pathname)s:%(lineno)d} %(levelname)s: %(message)s",
+    format=LOG_FORMAT,
     datefmt="%H:%M:%S",
     handlers=[logging.StreamHandler()],
 )
@@ -33,27 +46,145 @@ try:
 except ImportError:
     print("Missing `dotenv` dependency. Skipping using normal environment variables...")
 
+# Another API to connect to, like the fake gateway of the benchmarks
+if os.getenv("DISCORD_API_URL"):
+    discord.http.Route.BASE = os.getenv("DISCORD_API_URL").rstrip("/")
+
+command_seconds = metrics.histogram("camila_command_seconds", "Time spent running commands", ("command", "outcome"))
+command_errors = metrics.counter("camila_command_errors_total", "Commands which failed, by error", ("error",))
+startup_seconds = metrics.gauge("camila_startup_seconds", "Time spent in each startup phase", ("phase",))
+start_time = metrics.gauge("camila_start_time_seconds", "Unix time the bot was started at")
+
 cogs = []
 for file in os.listdir("cogs"):
     if file.endswith(".py"):
         cogs.append(f"cogs.{file[:-3]}")
 
 
+def cog_dependencies(extension: str) -> set:
+    """Returns the modules a cog imports at its top level, read from its source without running it"""
+    with open(f"{extension.replace('.', '/')}.py", "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+
+    modules = set()
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            modules.add(node.module)
+
+    return modules
+
+
 class Camila(commands.Bot):
     """
     Main Bot class derived from the discord.py Bot.
+    Startup runs once: the database, the login and the imports of the cogs' dependencies
+    are done side by side before connecting to the gateway.
     """
 
-    def __init__(self, command_prefix, description):
-        super().__init__(command_prefix=command_prefix, description=description)
+    def __init__(self, command_prefix, description, *, worker: int = 0, supervisor: int = None, **options):
+        # The activity is sent again on every reconnect, on_ready doesn't have to set it
+        super().__init__(
+            command_prefix=command_prefix,
+            description=description,
+            activity=discord.Activity(type=discord.ActivityType.watching, name="Politechnika Śląska"),
+            **options,
+        )
 
         random.seed(random.randrange(sys.maxsize))
 
+        # Index of this process among the workers and the pid of their supervisor, when sharded
+        self.worker = worker
+        self.supervisor = supervisor
+
+        self.db_holder = None
         self.failed_cogs = []
         self.exitcode = 0
 
+        # Startup phase -> seconds it took
+        self.startup_timings = {"imports": time.perf_counter() - STARTED}
+        self.started = False
+        self.connecting = None
+        start_time.set(time.time() - (time.perf_counter() - STARTED))
+
+        self.before_invoke(self.before_command)
+        self.after_invoke(self.after_command)
+
         os.makedirs("data", exist_ok=True)
 
+    @contextlib.contextmanager
+    def timed(self, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.startup_timings[phase] = time.perf_counter() - start
+
+    async def start(self, token, *, reconnect=True):
+        await asyncio.gather(self.prepare_cogs(), self.open_database(), self.timed_login(token))
+
+        with self.timed("cogs"):
+            self.load_cogs()
+        self.dispatch("database_ready", self.db_holder)
+
+        if self.supervisor:
+            self.loop.create_task(self.watch_supervisor())
+
+        self.connecting = time.perf_counter()
+        await self.connect(reconnect=reconnect)
+
+    async def watch_supervisor(self):
+        """Stops a worker left behind by its supervisor, a new supervisor would connect its shards a second time"""
+        while not self.is_closed():
+            await asyncio.sleep(5)
+            if os.getppid() != self.supervisor:
+                logging.warning("The supervisor is gone, stopping")
+                # Stops like on SIGTERM, the sharded connect keeps waiting for its shards after close()
+                self.loop.stop()
+                return
+
+    async def timed_login(self, token):
+        with self.timed("login"):
+            await self.login(token)
+
+    async def open_database(self):
+        with self.timed("database"):
+            self.db_holder = DatabaseConnector()
+            await self.db_holder.load_db(DB_PATH, self.loop)
+
+    def owns_guild(self, guild_id: int) -> bool:
+        """Whether the guild's events come to this process, always when it isn't sharded"""
+        return True
+
+    async def prepare_cogs(self):
+        """Imports the dependencies of every cog in worker threads, loading the cogs then finds them
+        already imported. The cogs themselves are loaded on the event loop, they may create asyncio objects"""
+        with self.timed("cog imports"):
+            modules = set()
+            for extension in cogs:
+                try:
+                    modules.update(cog_dependencies(extension))
+                except (OSError, SyntaxError):
+                    pass
+
+            results = await asyncio.gather(
+                *(self.loop.run_in_executor(None, importlib.import_module, module) for module in modules),
+                return_exceptions=True,
+            )
+
+        # A failing import is reported by load_cogs, together with the cog that needs it
+        for module, result in zip(modules, results):
+            if isinstance(result, Exception):
+                logging.debug(f"Preloading `{module}` failed: {result}")
+
+    async def before_command(self, ctx: commands.Context):
+        ctx.invoked_at = time.perf_counter()
+
+    async def after_command(self, ctx: commands.Context):
+        outcome = "error" if ctx.command_failed else "ok"
+        command_seconds.labels(ctx.command.qualified_name, outcome).observe(time.perf_counter() - ctx.invoked_at)
+
     def add_cog(self, cog):
         super().add_cog(cog)
         logging.info(f"Cog loaded: {cog.qualified_name}")
@@ -67,17 +198,17 @@ class Camila(commands.Bot):
                 self.failed_cogs.append([extension, type(e).__name__, e])
 
     async def on_ready(self):
-        self.db_holder = DatabaseConnector()
-        await self.db_holder.load_db(
-            DB_PATH,
-            self.loop,
-        )
+        # Fired again after every reconnect, everything was already set up by then
+        if self.started:
+            logging.info(f"{self.user.name} has reconnected to Discord")
+            return
+        self.started = True
 
-        await self.change_presence(
-            activity=discord.Activity(
-                type=discord.ActivityType.watching, name="Politechnika Śląska"
-            )
-        )
+        self.startup_timings["gateway"] = time.perf_counter() - self.connecting
+        for phase, seconds in self.startup_timings.items():
+            startup_seconds.labels(phase).set(seconds)
+        timings = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.startup_timings.items())
+        logging.info(f"Ready {time.perf_counter() - STARTED:.2f}s after start ({timings})")
 
         startup_message = f"{self.user.name} has connected to Discord!"
         if len(self.failed_cogs) != 0:
@@ -86,12 +217,20 @@ class Camila(commands.Bot):
                 startup_message += "\n{}: `{}: {}`".format(*fail)
         logging.info(startup_message)
 
+    async def close(self):
+        await super().close()
+
+        # Writes queued behind by the cogs are still flushed before exiting
+        if getattr(self, "db_holder", None):
+            await self.db_holder.close()
+
     async def on_command_error(
         self, ctx: commands.Context, exc: commands.CommandInvokeError
     ):
         author: discord.Member = ctx.author
         command: commands.Command = ctx.command or "<unknown command>"
         exc = getattr(exc, "original", exc)
+        command_errors.labels(type(exc).__name__).inc()
 
         if isinstance(exc, commands.CommandNotFound):
             await ctx.send("Command not found. Write !help to see available commands")
@@ -138,14 +277,34 @@ class Camila(commands.Bot):
         logging.error(f"Error in event: {event_method}, error msg: {msg}")
 
 
-def run_bot() -> int:
-    bot = Camila(
+class ShardedCamila(Camila, commands.AutoShardedBot):
+    """
+    Camila connected with a part of the shards, one of the workers run by the Supervisor.
+    Discord only sends a shard the events of its own guilds, voice included, so every
+    guild is played by the one worker owning its shard.
+    """
+
+    def owns_guild(self, guild_id: int) -> bool:
+        return (guild_id >> 22) % self.shard_count in self.shard_ids
+
+
+def run_bot(shard_ids: list = None, shard_count: int = None, worker: int = 0) -> int:
+    options = {}
+    bot_class = Camila
+    if shard_ids is not None:
+        bot_class = ShardedCamila
+        options = {"shard_ids": shard_ids, "shard_count": shard_count, "worker": worker, "supervisor": os.getppid()}
+
+    bot = bot_class(
         (".", "!"),
         description="Camila, a music/helper bot for managing small and private servers",
+        **options,
     )
     bot.help_command = commands.DefaultHelpCommand(dm_help=False)
-    logging.info(f"Starting SuperCamila")
-    bot.load_cogs()
+    if shard_ids is None:
+        logging.info(f"Starting SuperCamila")
+    else:
+        logging.info(f"Starting SuperCamila worker {worker} with shards {shard_ids} of {shard_count}")
     try:
         bot.run(os.getenv("DISCORD_BOT_TOKEN"))
     except KeyboardInterrupt:
@@ -154,5 +313,62 @@ def run_bot() -> int:
     return bot.exitcode
 
 
+def run_supervisor(workers: int, shard_count: int = None) -> int:
+    loop = asyncio.get_event_loop()
+    if shard_count is None:
+        try:
+            shard_count = max(workers, loop.run_until_complete(recommended_shards(os.getenv("DISCORD_BOT_TOKEN"))))
+        except (discord.DiscordException, OSError) as e:
+            logging.error(f"Asking Discord for the shard count failed, it can be given with --shard-count: {e}")
+            loop.close()
+            return 1
+
+    supervisor = Supervisor(
+        [sys.executable, os.path.abspath(__file__)],
+        workers=workers,
+        shard_count=shard_count,
+        identify_interval=SHARD_IDENTIFY_INTERVAL,
+        max_restarts=WORKER_MAX_RESTARTS,
+        restart_window=WORKER_RESTART_WINDOW,
+        max_backoff=WORKER_MAX_BACKOFF,
+        stop_timeout=WORKER_STOP_TIMEOUT,
+    )
+    logging.info(f"Starting SuperCamila with {shard_count} shards in {workers} workers")
+    try:
+        return loop.run_until_complete(supervisor.run())
+    finally:
+        loop.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Camila, a music/helper bot for managing small and private servers")
+    parser.add_argument("--workers", type=int, help="run the bot in this many processes, restarted when they crash")
+    parser.add_argument("--shard-count", type=int, help="shards in total, by default as many as Discord recommends")
+    parser.add_argument("--shard-ids", help="comma separated shards of a single worker, set by the supervisor")
+    parser.add_argument("--worker", type=int, default=0, help="index of a single worker, set by the supervisor")
+    args = parser.parse_args(argv)
+
+    # The supervisor logs in with it before any worker is started
+    if not os.getenv("DISCORD_BOT_TOKEN", "").strip():
+        parser.error("DISCORD_BOT_TOKEN is not set, fill it out in .env")
+
+    if args.shard_ids is not None:
+        if args.shard_count is None:
+            parser.error("--shard-ids needs --shard-count")
+        shard_ids = [int(shard_id) for shard_id in args.shard_ids.split(",")]
+
+        # Workers share the output of the supervisor
+        for handler in logging.getLogger().handlers:
+            handler.setFormatter(logging.Formatter(f"worker {args.worker} {LOG_FORMAT}", datefmt="%H:%M:%S"))
+        return run_bot(shard_ids, args.shard_count, args.worker)
+
+    if args.workers is not None:
+        if args.workers < 1 or (args.shard_count is not None and args.shard_count < args.workers):
+            parser.error("every worker needs at least one shard")
+        return run_supervisor(args.workers, args.shard_count)
+
+    return run_bot()
+
+
 if __name__ == "__main__":
-    exit(run_bot())
+    exit(main())
@@ -0,0 +1,284 @@
+import math
+import mmap
+import queue
+import importlib.util
+import threading
+import collections
+
+import discord
+from discord.oggparse import OggStream
+
+# NumPy is only imported once a PCM source needs it, Opus playback never does
+numpy = None
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+
+
+def _import_numpy():
+    global numpy
+
+    if numpy is None:
+        numpy = importlib.import_module("numpy")
+
+# Discord sends one 20ms frame per read
+FRAME_LENGTH = 0.02
+FRAME_SAMPLES = discord.opus.Encoder.FRAME_SIZE // 2
+CHANNELS = discord.opus.Encoder.CHANNELS
+
+
+class PrebufferedSource(discord.AudioSource):
+    """
+    Reads frames of the wrapped source ahead of time on a background thread.
+    Playback of a pre-warmed source starts from memory, without waiting for the
+    decoder process to start, connect and fill its own buffers.
+    """
+
+    def __init__(self, original: discord.AudioSource, *, frames: int = 150):
+        self.original = original
+        self.frames = 0
+
+        self._buffer = queue.Queue(maxsize=frames)
+        self._finished = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def __getattr__(self, name):
+        if name == "original":
+            raise AttributeError(name)
+        return getattr(self.original, name)
+
+    @property
+    def position(self):
+        return self.frames * FRAME_LENGTH
+
+    def _fill(self):
+        while not self._stopped.is_set():
+            try:
+                data = self.original.read()
+            except Exception:
+                # The decoder was torn down under our feet, treat it as the end of the stream
+                data = b""
+
+            while not self._stopped.is_set():
+                try:
+                    self._buffer.put(data, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+            if not data:
+                return
+
+    def read(self):
+        if self._finished:
+            return b""
+
+        data = self._buffer.get()
+        if not data:
+            self._finished = True
+            return b""
+
+        self.frames += 1
+        return data
+
+    def is_opus(self):
+        return self.original.is_opus()
+
+    def cleanup(self):
+        self._stopped.set()
+        self.original.cleanup()
+        self._thread.join(timeout=1)
+
+
+class CachedOpusSource(discord.AudioSource):
+    """
+    Plays an Ogg Opus file through a memory map, sending its packets as they are.
+    No decoder process is involved at all. Seeking to `start` skips whole packets.
+    """
+
+    def __init__(self, path: str, *, start: float = 0):
+        self.frames = 0
+        self._map = None
+
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._packets = OggStream(self._map).iter_packets()
+
+        for _ in range(int(start / FRAME_LENGTH)):
+            if not self.read():
+                break
+
+    @property
+    def position(self):
+        return self.frames * FRAME_LENGTH
+
+    def read(self):
+        for packet in self._packets:
+            # Identification and comment headers are not audio
+            if packet.startswith((b"OpusHead", b"OpusTags")):
+                continue
+
+            self.frames += 1
+            return packet
+
+        return b""
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        if self._map is not None:
+            self._packets = iter(())
+            self._map.close()
+            self._file.close()
+            self._map = None
+
+
+class DecodedOpusSource(discord.AudioSource):
+    """
+    PCM of an Opus source decoded in this process by libopus, which the voice client loads
+    anyway to encode PCM. Lets cached songs reach the volume transformer without ffmpeg.
+    """
+
+    def __init__(self, original: discord.AudioSource):
+        self.original = original
+        self._decoder = discord.opus.Decoder()
+
+    def __getattr__(self, name):
+        return getattr(self.original, name)
+
+    def read(self):
+        packet = self.original.read()
+        return self._decoder.decode(packet) if packet else b""
+
+    def is_opus(self):
+        return False
+
+    def cleanup(self):
+        self.original.cleanup()
+
+
+class NormalizingVolumeTransformer(discord.AudioSource):
+    """
+    Volume control for PCM sources done with NumPy on buffers reused between frames.
+    The track gain is estimated once from the loudness of the first frames, read as a single batch.
+    Volume can be changed while playing, the change is ramped over one frame to avoid clicks.
+    """
+
+    TARGET_RMS = 0.1
+    SILENCE_RMS = 0.005
+    MIN_GAIN = 0.5
+    MAX_GAIN = 2.0
+
+    def __init__(self, original: discord.AudioSource, volume: float = 1.0, *, analysis_frames: int = 50):
+        if original.is_opus():
+            raise discord.ClientException("AudioSource must not be Opus encoded.")
+
+        self.original = original
+        self.analysis_frames = analysis_frames
+        self.volume = volume
+
+        self.track_gain = None
+        self._gain = None
+        self._factor = None
+        self._bounds = None
+        self._pending = collections.deque()
+
+        _import_numpy()
+
+        self._work = numpy.empty(FRAME_SAMPLES, dtype=numpy.float32)
+        self._clipped = numpy.empty(FRAME_SAMPLES, dtype=numpy.int16)
+        self._out = numpy.empty(FRAME_SAMPLES, dtype=numpy.int16)
+        self._high = numpy.float32(32767)
+        self._low = numpy.float32(-32768)
+        # Interpolation steps shared by both channels of every sample pair
+        self._steps = numpy.repeat(numpy.linspace(0, 1, FRAME_SAMPLES // CHANNELS, dtype=numpy.float32), CHANNELS)
+        # Ramps between recently used gains, toggling between a few volumes reuses them
+        self._ramps = collections.OrderedDict()
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @volume.setter
+    def volume(self, value: float):
+        # Only stored here, the player thread picks it up on the next frame
+        self._volume = min(max(value, 0.0), 2.0)
+
+    def _analyse(self):
+        for _ in range(self.analysis_frames):
+            data = self.original.read()
+            if not data:
+                break
+            self._pending.append(data)
+
+        gain = 1.0
+        if self._pending:
+            samples = numpy.frombuffer(b"".join(self._pending), dtype=numpy.int16).astype(numpy.float32) / 32768
+            frames_rms = numpy.sqrt(numpy.mean(samples.reshape(-1, FRAME_SAMPLES) ** 2, axis=1))
+            # Quiet intros would push the gain up, so silent frames are left out of the estimate
+            loud = frames_rms[frames_rms > self.SILENCE_RMS]
+            if loud.size:
+                rms = float(numpy.sqrt(numpy.mean(loud ** 2)))
+                gain = min(max(self.TARGET_RMS / rms, self.MIN_GAIN), self.MAX_GAIN)
+
+        self.track_gain = gain
+        self._set_gain(gain * self._volume)
+
+    def _set_gain(self, gain: float):
+        # Kept as a Python float, comparing NumPy scalars on every frame costs more than the scaling
+        self._gain = gain
+        self._factor = numpy.float32(gain)
+        # Samples past these bounds would overflow once scaled, clipping them beforehand needs no float buffer
+        self._bounds = None
+        if gain > 1:
+            self._bounds = (numpy.int16(math.ceil(-32768 / gain)), numpy.int16(math.floor(32767 / gain)))
+
+    def _ramp(self, start: float, end: float):
+        key = (start, end)
+        ramp = self._ramps.get(key)
+        if ramp is None:
+            ramp = numpy.multiply(self._steps, numpy.float32(end - start))
+            ramp += numpy.float32(start)
+            self._ramps[key] = ramp
+            if len(self._ramps) > 8:
+                self._ramps.popitem(last=False)
+        return ramp
+
+    def read(self):
+        if self.track_gain is None:
+            self._analyse()
+
+        data = self._pending.popleft() if self._pending else self.original.read()
+        if not data:
+            return b""
+
+        samples = numpy.frombuffer(data, dtype=numpy.int16)
+        target = self.track_gain * self._volume
+
+        if target != self._gain:
+            start = self._gain
+            self._set_gain(target)
+            ramp = self._ramp(start, target)
+            if max(start, target) > 1:
+                # The gain changes within the frame, so the scaled samples are clipped instead
+                numpy.multiply(samples, ramp, out=self._work)
+                numpy.minimum(self._work, self._high, out=self._work)
+                numpy.maximum(self._work, self._low, out=self._out, casting="unsafe")
+            else:
+                numpy.multiply(samples, ramp, out=self._out, casting="unsafe")
+        elif self._bounds is not None:
+            samples.clip(*self._bounds, out=self._clipped)
+            numpy.multiply(self._clipped, self._factor, out=self._out, casting="unsafe")
+        else:
+            # Attenuation can't overflow, so the result goes straight into the output buffer
+            numpy.multiply(samples, self._factor, out=self._out, casting="unsafe")
+
+        return self._out.tobytes()
+
+    def cleanup(self):
+        self.original.cleanup()
+
+
+# NumPy is optional, without it the stock audioop based transformer is used
+VolumeTransformer = NormalizingVolumeTransformer if HAS_NUMPY else discord.PCMVolumeTransformer
@@ -0,0 +1,248 @@
+import os
+import re
+import time
+import shlex
+import asyncio
+import logging
+import collections
+
+
+class OpusCache:
+    """
+    On-disk cache of songs transcoded to Ogg Opus, kept under a size budget with LRU eviction.
+    A song is only stored once it was played `min_plays` times. Files are written under
+    a temporary name and renamed into place when complete, so a cached file is never partial.
+    The disk is only touched in the default executor, lookups are answered from the index in memory.
+    """
+
+    # A transcode keeps writing its part file, one left unchanged this long was abandoned
+    STALE_PART_AGE = 600
+
+    def __init__(self, path: str, *, budget: int, min_plays: int = 3, bitrate: int = 128, max_tracked: int = 10000):
+        self.path = path
+        self.budget = budget
+        self.min_plays = min_plays
+        self.bitrate = bitrate
+        self.max_tracked = max_tracked
+
+        # Plays of songs not cached yet, the least recently played are forgotten past `max_tracked`
+        self._plays = collections.OrderedDict()
+        self._files = collections.OrderedDict()
+        self._size = 0
+        self._loaded = None
+        self._transcoding = set()
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _key(video_id: str) -> str:
+        return re.sub(r"[^\w-]", "_", video_id)
+
+    def _file_path(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.ogg")
+
+    async def _run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+    async def load(self):
+        """Reads the cache directory, until then every song is treated as not cached"""
+        if self._loaded is None:
+            self._loaded = asyncio.ensure_future(self._load_files())
+        await asyncio.shield(self._loaded)
+
+    async def _load_files(self):
+        self._apply(await self._run(self._load))
+
+    def _load(self):
+        os.makedirs(self.path, exist_ok=True)
+
+        now = time.time()
+        for name in os.listdir(self.path):
+            if not name.endswith(".part"):
+                continue
+
+            path = os.path.join(self.path, name)
+            try:
+                # Leftover of a transcode interrupted by a restart, other workers may still be writing theirs
+                if now - os.path.getmtime(path) > self.STALE_PART_AGE:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        files = self._scan()
+        logging.info(f"Audio cache loaded: {len(files)} songs, {sum(files.values()) / 2 ** 20:.1f} MiB")
+        return files
+
+    def _scan(self) -> collections.OrderedDict:
+        """Reads the cached files from the disk, including the ones stored by other workers sharing it"""
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(".ogg"):
+                continue
+
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except FileNotFoundError:
+                continue
+            if stat.st_size:
+                entries.append((stat.st_mtime, name[:-4], stat.st_size))
+
+        return collections.OrderedDict((key, size) for _, key, size in sorted(entries))
+
+    def _apply(self, files: collections.OrderedDict):
+        self._files = collections.OrderedDict(files)
+        self._size = sum(self._files.values())
+
+    def __contains__(self, video_id: str):
+        return video_id is not None and self._key(video_id) in self._files
+
+    def __len__(self):
+        return len(self._files)
+
+    @property
+    def size(self):
+        return self._size
+
+    def forget(self, video_id: str):
+        """Drops a song whose file turned out to be gone, evicted by another worker"""
+        size = self._files.pop(self._key(video_id), None)
+        if size is not None:
+            self._size -= size
+
+    def get(self, video_id: str):
+        """Returns the path of the cached song and marks it as recently used"""
+        if video_id not in self:
+            return None
+
+        key = self._key(video_id)
+        self._files.move_to_end(key)
+
+        file_path = self._file_path(key)
+        # The modification time keeps the LRU order across restarts and for the other workers
+        asyncio.get_event_loop().run_in_executor(None, self._touch, file_path)
+        return file_path
+
+    @staticmethod
+    def _touch(file_path: str):
+        try:
+            os.utime(file_path)
+        except FileNotFoundError:
+            pass
+
+    def record_play(self, video_id: str) -> bool:
+        """Counts a play of the song, returns True when it should be stored now"""
+        if video_id is None or video_id in self:
+            return False
+
+        key = self._key(video_id)
+        plays = self._plays.pop(key, 0) + 1
+        self._plays[key] = plays
+        if len(self._plays) > self.max_tracked:
+            self._plays.popitem(last=False)
+
+        return plays >= self.min_plays and key not in self._transcoding
+
+    async def store(self, video_id: str, stream_url: str, *, codec: str = None, before_options: str = "", on_process=None):
+        """
+        Transcodes the song into the cache, `on_process` is called with the ffmpeg process once it started.
+        Cancelling the task kills the process and removes what it wrote.
+        """
+        key = self._key(video_id)
+        if key in self._transcoding:
+            return
+
+        self._transcoding.add(key)
+        try:
+            # One transcode at a time, they are background work competing with playback
+            async with self._lock:
+                await self.load()
+                # Another worker sharing the directory may have stored it meanwhile
+                self._apply(await self._run(self._scan))
+                if key in self._files:
+                    self._plays.pop(key, None)
+                    return
+
+                await self._transcode(key, stream_url, codec, before_options, on_process)
+        finally:
+            self._transcoding.discard(key)
+
+    async def _transcode(self, key: str, stream_url: str, codec: str, before_options: str, on_process):
+        file_path = self._file_path(key)
+        temp_path = f"{file_path}.{os.getpid()}.part"
+
+        if codec == "opus":
+            encoding = ("-c:a", "copy")
+        else:
+            encoding = ("-c:a", "libopus", "-b:a", f"{self.bitrate}k", "-ar", "48000", "-ac", "2")
+
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg",
+            *shlex.split(before_options),
+            "-i",
+            stream_url,
+            "-vn",
+            "-map_metadata",
+            "-1",
+            *encoding,
+            "-f",
+            "ogg",
+            "-loglevel",
+            "error",
+            "-y",
+            temp_path,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        if on_process:
+            on_process(process)
+
+        try:
+            _, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            if process.returncode is None:
+                process.kill()
+            await process.wait()
+            await self._run(self._remove, temp_path)
+            raise
+
+        size = await self._run(self._commit, temp_path, file_path, process.returncode == 0)
+        if size is None:
+            logging.warning(f"Caching `{key}` failed: {stderr.decode(errors='replace').strip()}")
+            return
+
+        self._plays.pop(key, None)
+        logging.info(f"Cached `{key}` ({size / 2 ** 20:.1f} MiB)")
+
+        files, evicted = await self._run(self._evict)
+        self._apply(files)
+        for evicted_key in evicted:
+            logging.info(f"Evicted `{evicted_key}` from the audio cache")
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _commit(self, temp_path: str, file_path: str, succeeded: bool):
+        """Moves a finished transcode into place, returns its size or None when it failed"""
+        if not succeeded or not os.path.isfile(temp_path):
+            self._remove(temp_path)
+            return None
+
+        os.replace(temp_path, file_path)
+        return os.path.getsize(file_path)
+
+    def _evict(self):
+        # Workers sharing the directory all store into it, the budget holds for all of them together
+        files = self._scan()
+        size = sum(files.values())
+        evicted = []
+        while size > self.budget and len(files) > 1:
+            key, file_size = files.popitem(last=False)
+            size -= file_size
+            # Songs playing from the evicted file keep their mapping until they finish
+            self._remove(self._file_path(key))
+            evicted.append(key)
+        return files, evicted
@@ -0,0 +1,130 @@
+import time
+import logging
+import threading
+import collections
+
+import discord
+
+from camila.audio import FRAME_LENGTH
+
+# Opus packet of 20ms of silence, sent while a subscriber waits for data
+SILENCE = b"\xf8\xff\xfe"
+
+
+class BroadcastSubscriber(discord.AudioSource):
+    """
+    Opus source fed by a `Broadcast`, meant to be played by a single voice client.
+    Packets are kept in a bounded buffer that drops the oldest ones when the client falls behind.
+    """
+
+    def __init__(self, broadcast: "Broadcast", maxlen: int):
+        self.broadcast = broadcast
+
+        self._packets = collections.deque(maxlen=maxlen)
+        self._ready = threading.Condition()
+        self._finished = False
+
+    def push(self, packet: bytes):
+        with self._ready:
+            self._packets.append(packet)
+            self._ready.notify()
+
+    def read(self):
+        if self._finished:
+            return b""
+
+        with self._ready:
+            if not self._packets and not self._ready.wait(timeout=FRAME_LENGTH * 5):
+                return SILENCE
+            packet = self._packets.popleft()
+
+        if not packet:
+            self._finished = True
+        return packet
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self.broadcast.unsubscribe(self)
+
+
+class Broadcast:
+    """
+    Reads a source once, in real time, and fans its Opus packets out to every subscriber.
+    PCM sources are encoded a single time here, so the cost doesn't grow with the audience.
+    """
+
+    def __init__(self, source: discord.AudioSource, *, buffer: int = 50):
+        self.source = source
+        self.buffer = buffer
+
+        self._encoder = None if source.is_opus() else discord.opus.Encoder()
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self) -> BroadcastSubscriber:
+        subscriber = BroadcastSubscriber(self, self.buffer)
+        with self._lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: BroadcastSubscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def start(self):
+        self._thread.start()
+
+    def _next_packet(self) -> bytes:
+        try:
+            data = self.source.read()
+        except Exception:
+            logging.exception("Broadcast source failed")
+            return b""
+
+        if data and self._encoder is not None:
+            data = self._encoder.encode(data, self._encoder.SAMPLES_PER_FRAME)
+        return data
+
+    def _run(self):
+        start = time.perf_counter()
+        loops = 0
+
+        try:
+            while not self._stopped.is_set():
+                packet = self._next_packet()
+
+                with self._lock:
+                    subscribers = list(self._subscribers)
+                for subscriber in subscribers:
+                    subscriber.push(packet)
+
+                if not packet:
+                    return
+
+                # Paced like the discord.py audio player, subscribers receive packets in real time
+                loops += 1
+                time.sleep(max(0, start + FRAME_LENGTH * loops - time.perf_counter()))
+        finally:
+            self.source.cleanup()
+
+    def stop(self):
+        """Stops reading the source and ends playback for every remaining subscriber"""
+        self._stopped.set()
+        if self._thread.ident is None:
+            # Never started, so the reading thread won't clean the source up
+            self.source.cleanup()
+        else:
+            self._thread.join(timeout=1)
+
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, []
+        for subscriber in subscribers:
+            subscriber.push(b"")
@@ -1 +1,72 @@
-DB_PATH = "data/camila.sqlite"
\ No newline at end of file
+DB_PATH = "data/camila.sqlite"
+
+EXTRACTION_WORKERS = 2
+EXTRACTION_TIMEOUT = 30
+EXTRACTION_MAX_JOBS = 200
+
+SCHEDULER_PER_GUILD = 1
+SCHEDULER_MAX_PENDING = 32
+
+PREFETCH_TRACKS = 3
+PREFETCH_REFRESH_BEFORE = 300
+PREFETCH_RETRY_DELAY = 30
+
+GAPLESS_PREWARM = 5
+GAPLESS_BUFFER_FRAMES = 150
+
+# "pcm" decodes songs to PCM, normalizes their loudness and applies !volume live, for a few
+# microseconds of Python per 20 ms frame. "opus" lets ffmpeg encode (or copy) Opus and apply
+# the volume, cheaper but without normalization and volume changes only apply from the next song
+PLAYBACK_MODE = "pcm"
+
+AUDIO_CACHE_PATH = "data/audio"
+AUDIO_CACHE_BUDGET = 2 * 1024 ** 3
+AUDIO_CACHE_MIN_PLAYS = 3
+
+RADIO_BUFFER_FRAMES = 50
+
+PLAYLIST_MAX_SONGS = 500
+# Playlist entries read by a single extraction job, a page of a YouTube playlist
+PLAYLIST_BATCH = 100
+
+SEARCH_RESULTS = 5
+SEARCH_RESULTS_TTL = 300
+
+# Seconds between checkpoints of the music players
+PLAYER_STATE_INTERVAL = 15
+
+# Seconds before an idle player or one left alone in its channel is closed
+PLAYER_IDLE_TIMEOUT = 180
+PLAYER_ALONE_TIMEOUT = 60
+PLAYER_REAP_INTERVAL = 15
+
+PLAN_PATH = "data/plan"
+PLAN_MAX_SIZE = 10 * 1024 ** 2
+PLAN_DOWNLOAD_TIMEOUT = 30
+
+# "webp" or "png", plans are downscaled to fit PLAN_MAX_RESOLUTION pixels on the longer side
+PLAN_FORMAT = "webp"
+PLAN_MAX_RESOLUTION = 2048
+PLAN_PREVIEW_RESOLUTION = 400
+PLAN_PROCESS_TIMEOUT = 60
+# Seconds between looks at the plan directory for plans changed by other workers
+PLAN_REFRESH_INTERVAL = 5
+
+# Upcoming events kept in memory at once, the rest is loaded as they are reached
+EVENTS_LOADED = 64
+EVENTS_DATE_FORMAT = "%Y-%m-%d %H:%M"
+# Zone the dates of events are typed and shown in, whatever the zone of the host
+EVENTS_TIMEZONE = "Europe/Warsaw"
+
+# Local address of the metrics endpoint, None as the port disables it
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
+
+# Seconds Discord wants between two shards identifying, workers are started this far apart per shard
+SHARD_IDENTIFY_INTERVAL = 5
+
+# A worker crashing more than WORKER_MAX_RESTARTS times within WORKER_RESTART_WINDOW seconds is given up on
+WORKER_MAX_RESTARTS = 5
+WORKER_RESTART_WINDOW = 300
+WORKER_MAX_BACKOFF = 60
+WORKER_STOP_TIMEOUT = 30
\ No newline at end of file
@@ -1,32 +1,324 @@
 import os
+import re
+import asyncio
 import logging
+import sqlite3
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 import aiosqlite3
 
+from camila.dates import local_timestamp
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, the bot isn't run as several workers there
+    fcntl = None
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    # With WAL a crash can only lose the last commits, never corrupt the database
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+
 
 class DatabaseConnector:
-    def __init__(self):
+    """
+    SQLite in WAL mode with a small pool of read-only connections and a single writer.
+    Writes are queued and the writer task applies everything queued within `flush_interval`
+    as one transaction, each write in its own savepoint so a failing one doesn't take the rest down.
+    Statements are parameterized and cached per connection, so repeated queries are only prepared once.
+    """
+
+    def __init__(self, *, readers: int = 2, flush_interval: float = 0.05, max_batch: int = 256):
+        self.readers = readers
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+
         self.db = None
+        self._readers = None
+        self._writes = None
+        self._writer = None
+        # Writes a cancelled writer had taken off the queue without committing them, close() writes them
+        self._unwritten = []
+        self._executors = []
 
     async def load_db(self, db_name, loop):
         if not os.path.isfile(db_name):
             logging.info(f"Creating new database: {db_name}")
+
+        self.db = await self._connect(db_name, loop, workers=1)
+        for pragma in PRAGMAS:
+            await self.db.execute(pragma)
+        # Conversions SQLite can't do itself, for the migrations
+        await self.db.create_function("local_timestamp", 1, local_timestamp)
+
+        # Workers of a sharded bot start side by side, only one of them migrates at a time
+        lock = await loop.run_in_executor(None, self._lock, f"{db_name}.lock")
+        try:
+            # The schema only creates missing tables, so it is safe to apply it on every start
             with open("schema.sql", "r", encoding="utf-8") as f:
                 schema = f.read()
-            self.db = await aiosqlite3.connect(db_name, loop=loop)
             await self.db.executescript(schema)
-            await self.db.commit()
-            logging.info(f"Database initialized: {db_name}")
-        else:
-            self.db = await aiosqlite3.connect(db_name, loop=loop)
-            logging.info(f"Database loaded: {db_name}")
-
-    async def __aenter__(self):
-        self.db.__enter__()
-        cursor = await self.db.cursor()
-        return cursor
-
-    async def __aexit__(self, exc_class, exc, traceback):
-        self.db.__exit__(exc_class, exc, traceback)
-        if self.db.in_transaction:
-            await self.db.commit()
+            await self.migrate()
+        finally:
+            lock.close()
+
+        self._readers = asyncio.Queue()
+        for _ in range(self.readers):
+            reader = await self._connect(f"file:{db_name}?mode=ro", loop, workers=1, uri=True)
+            await reader.execute("PRAGMA busy_timeout = 5000")
+            self._readers.put_nowait(reader)
+
+        self._writes = asyncio.Queue()
+        self._writer = loop.create_task(self.writer_task())
+        logging.info(f"Database loaded: {db_name}")
+
+    @staticmethod
+    def _lock(path: str):
+        """Opens the lock file and waits for an exclusive lock on it, closing the file releases it"""
+        lock = open(path, "a")
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    async def _connect(self, database: str, loop, *, workers: int, **kwargs):
+        # Every connection gets its own thread, so a slow write never holds up reads
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sqlite")
+        self._executors.append(executor)
+
+        return await aiosqlite3.connect(
+            database,
+            loop=loop,
+            executor=executor,
+            isolation_level=None,
+            cached_statements=256,
+            **kwargs,
+        )
+
+    async def migrate(self):
+        """Applies the numbered scripts from `migrations/` newer than the database's user_version"""
+        cursor = await self.db.execute("PRAGMA user_version")
+        (version,) = await cursor.fetchone()
+
+        migrations = sorted(
+            (int(match.group(1)), path)
+            for path in Path("migrations").glob("*.sql")
+            for match in [re.match(r"(\d+)_", path.name)]
+            if match
+        )
+        for number, path in migrations:
+            if number <= version:
+                continue
+
+            script = path.read_text(encoding="utf-8")
+            try:
+                await self.db.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {number};\nCOMMIT;")
+            except sqlite3.Error:
+                if self.db.in_transaction:
+                    await self.db.rollback()
+                logging.error(f"Database migration {path.name} failed")
+                raise
+
+            logging.info(f"Database migrated to version {number}: {path.name}")
+
+    async def close(self):
+        if self._writer is not None:
+            writer, self._writer = self._writer, None
+            # On a signal discord.py cancels every task before the bot is closed, the writer included.
+            # It is stopped either way and everything queued so far is written here
+            writer.cancel()
+            await asyncio.gather(writer, return_exceptions=True)
+            await self._flush()
+
+        if self._readers is not None:
+            while not self._readers.empty():
+                await self._readers.get_nowait().close()
+            self._readers = None
+
+        if self.db is not None:
+            await self.db.close()
+            self.db = None
+
+        for executor in self._executors:
+            executor.shutdown(wait=False)
+        self._executors = []
+
+    async def fetchone(self, sql: str, params=()):
+        reader = await self._readers.get()
+        try:
+            cursor = await reader.execute(sql, params)
+            return await cursor.fetchone()
+        finally:
+            self._readers.put_nowait(reader)
+
+    async def fetchall(self, sql: str, params=()):
+        reader = await self._readers.get()
+        try:
+            cursor = await reader.execute(sql, params)
+            return await cursor.fetchall()
+        finally:
+            self._readers.put_nowait(reader)
+
+    def transaction(self, job) -> asyncio.Future:
+        """Queues `job`, a coroutine function called with the writer's cursor.
+        Its statements are committed atomically, the returned future gets its result"""
+        future = asyncio.get_event_loop().create_future()
+        self._writes.put_nowait((job, future))
+        return future
+
+    def execute(self, sql: str, params=()) -> asyncio.Future:
+        """Queues a single write, the returned future gets its row count once committed"""
+
+        async def job(cursor):
+            await cursor.execute(sql, params)
+            return cursor.rowcount
+
+        return self.transaction(job)
+
+    def executemany(self, sql: str, seq_of_params) -> asyncio.Future:
+        seq_of_params = list(seq_of_params)
+
+        async def job(cursor):
+            await cursor.executemany(sql, seq_of_params)
+            return cursor.rowcount
+
+        return self.transaction(job)
+
+    def write(self, sql: str, params=()):
+        """Write-behind, the caller doesn't wait for the commit and failures are only logged"""
+        self.execute(sql, params).add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.warning(f"Database write failed: {future.exception()}")
+
+    async def writer_task(self):
+        loop = asyncio.get_event_loop()
+
+        while True:
+            batch = []
+            try:
+                batch.append(await self._writes.get())
+
+                # Whatever arrives shortly after the first write shares its transaction
+                deadline = loop.time() + self.flush_interval
+                while len(batch) < self.max_batch:
+                    if not self._writes.empty():
+                        batch.append(self._writes.get_nowait())
+                        continue
+
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._writes.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+
+                await self._write_batch(batch)
+            except asyncio.CancelledError:
+                self._unwritten.extend((job, future) for job, future in batch if not future.done())
+                raise
+            finally:
+                for _ in batch:
+                    self._writes.task_done()
+
+    async def _write_batch(self, batch: list):
+        try:
+            await self._apply(batch)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The writer has to outlive any failure, every later write would wait for it forever
+            logging.error(f"Database writer failed on a batch of {len(batch)} writes: {type(e).__name__}: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def _flush(self):
+        """Writes what a stopped writer left behind, the batch it was cancelled with and the rest of the queue"""
+        while self._unwritten or not self._writes.empty():
+            batch, self._unwritten = self._unwritten, []
+            while not self._writes.empty():
+                batch.append(self._writes.get_nowait())
+                self._writes.task_done()
+            await self._write_batch(batch)
+
+    async def _apply(self, batch: list):
+        cursor = None
+        results = []
+        committing = False
+
+        try:
+            cursor = await self.db.cursor()
+            # Takes the write lock right away, other processes writing make it wait for busy_timeout
+            # instead of failing the transaction halfway
+            await cursor.execute("BEGIN IMMEDIATE")
+            for job, future in batch:
+                if future.cancelled():
+                    continue
+
+                await cursor.execute("SAVEPOINT write")
+                try:
+                    result = await job(cursor)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    await cursor.execute("ROLLBACK TO write")
+                    results.append((future, None, e))
+                else:
+                    results.append((future, result, None))
+                await cursor.execute("RELEASE write")
+
+            committing = True
+            await cursor.execute("COMMIT")
+        except asyncio.CancelledError:
+            # The statement in flight still runs on the connection's thread and the rollback is queued
+            # behind it, only a COMMIT which went through leaves no transaction to roll back
+            if not await self._rollback_cancelled() and committing:
+                self._resolve(results)
+            raise
+        except Exception as e:
+            # Not only SQLite errors, whatever fails the transaction fails the whole batch
+            logging.warning(f"Database transaction of {len(batch)} writes failed: {type(e).__name__}: {e}")
+            await self._rollback()
+            results = [(future, None, e) for _, future in batch]
+        finally:
+            if cursor is not None:
+                try:
+                    await cursor.close()
+                except sqlite3.Error:
+                    pass
+
+        self._resolve(results)
+
+    @staticmethod
+    def _resolve(results: list):
+        for future, result, exception in results:
+            if future.done():
+                continue
+            if exception is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exception)
+
+    async def _rollback_cancelled(self) -> bool:
+        """Rolls back the transaction of a cancelled batch, returns False when there was none left"""
+        try:
+            await self.db.execute("ROLLBACK")
+        except sqlite3.Error:
+            return False
+        return True
+
+    async def _rollback(self):
+        try:
+            if self.db.in_transaction:
+                await self.db.rollback()
+        except sqlite3.Error as e:
+            logging.error(f"Database rollback failed: {e}")
@@ -0,0 +1,28 @@
+from datetime import datetime
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    # Before Python 3.9 dates are read in the zone of the host
+    ZoneInfo = None
+
+from camila.constants import EVENTS_TIMEZONE
+
+timezone = ZoneInfo(EVENTS_TIMEZONE) if ZoneInfo else None
+
+
+def parse_local(text: str, fmt: str) -> int:
+    """Epoch seconds of a date written in EVENTS_TIMEZONE, raises ValueError when it doesn't match `fmt`"""
+    return int(datetime.strptime(text, fmt).replace(tzinfo=timezone).timestamp())
+
+
+def format_local(timestamp: float, fmt: str) -> str:
+    return datetime.fromtimestamp(timestamp, timezone).strftime(fmt)
+
+
+def local_timestamp(text: str):
+    """SQL function for the migrations, an ISO date written in EVENTS_TIMEZONE as epoch seconds or NULL"""
+    try:
+        return int(datetime.fromisoformat(text).replace(tzinfo=timezone).timestamp())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,51 @@
+import os
+import asyncio
+import logging
+import tempfile
+
+import aiohttp
+from async_timeout import timeout
+
+from camila.exceptions import DownloadError
+
+CHUNK_SIZE = 64 * 1024
+
+
+async def download(session: aiohttp.ClientSession, url: str, destination: str, *, max_size: int, seconds: float):
+    """Streams `url` into a temporary file next to `destination` and renames it into place.
+    Nothing is left behind when the download is too big, too slow or fails"""
+    directory = os.path.dirname(destination) or "."
+    fd, part = tempfile.mkstemp(dir=directory, suffix=".part")
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            size = await _stream(session, url, f, max_size=max_size, seconds=seconds)
+        os.replace(part, destination)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        os.remove(part)
+        raise DownloadError(str(e) or type(e).__name__) from e
+    except BaseException:
+        os.remove(part)
+        raise
+
+    logging.info(f"Downloaded `{url}` as `{destination}` ({size} bytes)")
+    return size
+
+
+async def _stream(session: aiohttp.ClientSession, url: str, f, *, max_size: int, seconds: float) -> int:
+    async with timeout(seconds):
+        async with session.get(url) as response:
+            if response.status != 200:
+                raise DownloadError(f"HTTP {response.status}")
+
+            if response.content_length and response.content_length > max_size:
+                raise DownloadError(f"File is larger than {max_size} bytes")
+
+            size = 0
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise DownloadError(f"File is larger than {max_size} bytes")
+                f.write(chunk)
+
+    return size
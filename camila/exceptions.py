@@ -3,4 +3,16 @@ class VoiceError(Exception):
 
 
 class YTDLError(Exception):
+    pass
+
+
+class OverloadedError(Exception):
+    pass
+
+
+class DownloadError(Exception):
+    pass
+
+
+class ImageError(Exception):
     pass
\ No newline at end of file
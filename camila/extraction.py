@@ -0,0 +1,165 @@
+import asyncio
+import functools
+import itertools
+from concurrent.futures.process import BrokenProcessPool
+
+from camila.exceptions import YTDLError
+from camila.workers import WorkerPool
+
+# YoutubeDL instance owned by the current worker process
+_ytdl = None
+
+
+def _init_worker(options: dict):
+    global _ytdl
+
+    import youtube_dl
+
+    youtube_dl.utils.bug_reports_message = lambda: ""
+    _ytdl = youtube_dl.YoutubeDL(options)
+
+
+def _compact(info: dict, fields: tuple) -> dict:
+    return {field: info.get(field) for field in fields}
+
+
+def _compact_entry(entry: dict, fields: tuple) -> dict:
+    compact = _compact(entry, fields)
+
+    if not compact.get("webpage_url"):
+        # Flat playlist and search entries only carry the video id in `url`
+        url = entry.get("url")
+        if entry.get("ie_key") == "Youtube" and url and "://" not in url:
+            url = f"https://www.youtube.com/watch?v={url}"
+        compact["webpage_url"] = url
+
+    return compact
+
+
+def _extraction_job(func):
+    """Raises whatever youtube_dl or its extractors fail with as YTDLError, the one error callers handle.
+    Extractor bugs surface as any exception, some of which can't even be pickled back from the worker"""
+
+    @functools.wraps(func)
+    def job(*args):
+        try:
+            return func(*args)
+        except YTDLError:
+            raise
+        except Exception as e:
+            raise YTDLError(str(e) or type(e).__name__) from None
+
+    return job
+
+
+def _extract_info_flat(search: str, playlist: bool):
+    # Workers run one job at a time, so the option can be flipped for the duration of this job
+    noplaylist = _ytdl.params.get("noplaylist")
+    _ytdl.params["noplaylist"] = not playlist
+
+    try:
+        return _ytdl.extract_info(search, download=False, process=False)
+    finally:
+        _ytdl.params["noplaylist"] = noplaylist
+
+
+@_extraction_job
+def _extract_flat(search: str, fields: tuple, limit: int) -> list:
+    data = _extract_info_flat(search, playlist=False)
+    if data is None:
+        return []
+
+    if "entries" not in data:
+        return [_compact_entry(data, fields)]
+
+    # Entries can be a lazy generator, only the requested amount is pulled from it
+    entries = filter(None, data["entries"])
+    return [_compact_entry(entry, fields) for entry in itertools.islice(entries, limit)]
+
+
+@_extraction_job
+def _extract_playlist(url: str, fields: tuple, start: int, limit: int) -> tuple:
+    """
+    Returns `limit` entries of the playlist from `start` on, the ones playliststart/playlistend would select,
+    and how many more it has after them. The count is None when the playlist goes on but its length
+    isn't known, finding it out would fetch every remaining page.
+    """
+    from youtube_dl.utils import PagedList
+
+    data = _extract_info_flat(url, playlist=True)
+    if data is None:
+        return [], 0
+
+    if "entries" not in data:
+        return [_compact_entry(data, fields)] if start == 0 else [], 0
+
+    entries = data["entries"]
+    end = start + limit
+    if isinstance(entries, list):
+        remaining = max(len(entries) - end, 0)
+        entries = entries[start:end]
+    else:
+        # A single entry past the slice tells whether the playlist goes on
+        if isinstance(entries, PagedList):
+            # Only the pages covering the slice are fetched
+            entries = entries.getslice(start, end + 1)
+        else:
+            # A generator fetches the pages before `start` again
+            entries = list(itertools.islice(entries, start, end + 1))
+        remaining = None if len(entries) > limit else 0
+        entries = entries[:limit]
+
+    return [_compact_entry(entry, fields) for entry in entries if entry], remaining
+
+
+@_extraction_job
+def _extract_full(url: str, fields: tuple):
+    info = _ytdl.extract_info(url, download=False)
+
+    if info is None:
+        return None
+
+    if "entries" in info:
+        info = next(filter(None, info["entries"]), None)
+        if info is None:
+            return None
+
+    return _compact(info, fields)
+
+
+class ExtractionService(WorkerPool):
+    """
+    Runs youtube_dl extraction in a dedicated pool of worker processes,
+    keeping the CPU heavy parsing away from the event loop thread.
+    Every worker holds its own YoutubeDL instance and the pool is replaced
+    after `max_jobs` jobs to release whatever the extractors accumulated.
+    """
+
+    def __init__(self, options: dict, *, workers: int = 2, timeout: float = 30, max_jobs: int = 200):
+        super().__init__(
+            "Extraction",
+            workers=workers,
+            timeout=timeout,
+            max_jobs=max_jobs,
+            initializer=_init_worker,
+            initargs=(options,),
+        )
+        self.options = options
+
+    async def run(self, func, *args, loop: asyncio.BaseEventLoop = None):
+        try:
+            return await super().run(func, *args, loop=loop)
+        except BrokenProcessPool:
+            # The pool was already replaced, the job failed like any other extraction
+            raise YTDLError("Proces pobierania przestał działać, spróbuj ponownie") from None
+
+    async def extract_flat(self, search: str, fields: tuple, *, limit: int = 1, loop: asyncio.BaseEventLoop = None):
+        return await self.run(_extract_flat, search, fields, limit, loop=loop)
+
+    async def extract_playlist(
+        self, url: str, fields: tuple, *, start: int, limit: int, loop: asyncio.BaseEventLoop = None
+    ):
+        return await self.run(_extract_playlist, url, fields, start, limit, loop=loop)
+
+    async def extract_full(self, url: str, fields: tuple, *, loop: asyncio.BaseEventLoop = None):
+        return await self.run(_extract_full, url, fields, loop=loop)
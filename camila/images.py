@@ -0,0 +1,80 @@
+import os
+import asyncio
+
+from camila.exceptions import ImageError
+from camila.workers import WorkerPool
+
+# Formats accepted from uploads, detected from the file contents
+INPUT_FORMATS = ("PNG", "JPEG", "GIF", "WEBP", "BMP")
+
+
+def _save(image, path: str, fmt: str):
+    part = f"{path}.part"
+    try:
+        if fmt == "webp":
+            image.save(part, "WEBP", quality=85, method=6)
+        else:
+            image.save(part, "PNG", optimize=True)
+        os.replace(part, path)
+    except BaseException:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+
+
+def _process_plan(source: str, destination: str, preview: str, fmt: str, max_size: int, preview_size: int) -> dict:
+    from PIL import Image, ImageOps
+
+    # Pillow decodes lazily, a truncated upload only fails once its pixels are needed
+    try:
+        image = Image.open(source)
+        detected = image.format
+        if detected not in INPUT_FORMATS:
+            raise ImageError(f"Unsupported image format: {detected}")
+
+        # JPEG can be decoded straight at a fraction of its size, which is most of the work for photos
+        image.draft("RGB", (max_size, max_size))
+        image = ImageOps.exif_transpose(image)
+
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        image = image.convert("RGBA" if has_alpha else "RGB")
+
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise ImageError(str(e)) from None
+
+    # Decoded by now, failing to save is a problem of the disk and not of the upload
+    _save(image, destination, fmt)
+    image.thumbnail((preview_size, preview_size), Image.LANCZOS)
+    _save(image, preview, fmt)
+
+    return {
+        "format": detected,
+        "size": os.path.getsize(destination),
+        "preview_size": os.path.getsize(preview),
+    }
+
+
+class ImageService(WorkerPool):
+    """
+    Runs Pillow in a small pool of worker processes, so decoding and
+    recompressing large uploads never holds up the event loop.
+    """
+
+    def __init__(self, *, workers: int = 1, timeout: float = 60):
+        super().__init__("Image", workers=workers, timeout=timeout)
+
+    async def process_plan(
+        self,
+        source: str,
+        destination: str,
+        preview: str,
+        *,
+        fmt: str,
+        max_size: int,
+        preview_size: int,
+        loop: asyncio.BaseEventLoop = None,
+    ):
+        """Detects the format of `source`, downscales it to `max_size` and recompresses it into
+        `destination`, with a `preview_size` copy written to `preview`"""
+        return await self.run(_process_plan, source, destination, preview, fmt, max_size, preview_size, loop=loop)
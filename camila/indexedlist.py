@@ -0,0 +1,155 @@
+import random
+import itertools
+
+
+class IndexedList:
+    """
+    List kept in chunks of up to `2 * load` items, with a Fenwick tree over the chunk sizes.
+    Finding a position takes O(log n) and inserting or deleting only shifts the items of
+    a single chunk, so positional operations stay cheap for lists of tens of thousands of items.
+    """
+
+    def __init__(self, iterable=(), *, load: int = 64):
+        self._load = load
+        self._chunks = []
+        self._tree = [0]
+        self._len = 0
+
+        self._rebuild(list(iterable))
+
+    def _rebuild(self, items: list):
+        self._chunks = [items[i : i + self._load] for i in range(0, len(items), self._load)]
+        self._len = len(items)
+        self._build_tree()
+
+    def _build_tree(self):
+        size = len(self._chunks)
+        tree = [0] * (size + 1)
+        for i, chunk in enumerate(self._chunks, start=1):
+            tree[i] += len(chunk)
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, chunk_index: int, delta: int):
+        i = chunk_index + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _normalize(self, index: int) -> int:
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("list index out of range")
+        return index
+
+    def _locate(self, index: int):
+        """Returns the chunk holding `index` and the offset inside of it"""
+        position = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            following = position + step
+            if following < len(self._tree) and self._tree[following] <= index:
+                position = following
+                index -= self._tree[following]
+            step >>= 1
+        return position, index
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._chunks)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self._len)
+            if step != 1 or start >= stop:
+                return list(itertools.islice(self, start, stop, step)) if step > 0 else list(self)[item]
+
+            chunk_index, offset = self._locate(start)
+            result = []
+            for chunk in itertools.islice(self._chunks, chunk_index, None):
+                result.extend(chunk[offset : offset + stop - start - len(result)])
+                offset = 0
+                if len(result) >= stop - start:
+                    break
+            return result
+
+        chunk_index, offset = self._locate(self._normalize(item))
+        return self._chunks[chunk_index][offset]
+
+    def __delitem__(self, index: int):
+        self.pop(index)
+
+    def append(self, item):
+        if not self._chunks or len(self._chunks[-1]) >= self._load:
+            self._chunks.append([item])
+            self._len += 1
+            # Growing the tree by a node only needs the sums of the nodes it covers
+            i = len(self._chunks)
+            total, child = 1, i - 1
+            while child > i - (i & -i):
+                total += self._tree[child]
+                child -= child & -child
+            self._tree.append(total)
+        else:
+            self._chunks[-1].append(item)
+            self._len += 1
+            self._tree_add(len(self._chunks) - 1, 1)
+
+    def insert(self, index: int, item):
+        if index < 0:
+            index = max(index + self._len, 0)
+        if index >= self._len:
+            return self.append(item)
+
+        chunk_index, offset = self._locate(index)
+        chunk = self._chunks[chunk_index]
+        chunk.insert(offset, item)
+        self._len += 1
+
+        if len(chunk) > 2 * self._load:
+            self._chunks[chunk_index : chunk_index + 1] = [chunk[: self._load], chunk[self._load :]]
+            self._build_tree()
+        else:
+            self._tree_add(chunk_index, 1)
+
+    def pop(self, index: int = -1):
+        chunk_index, offset = self._locate(self._normalize(index))
+        chunk = self._chunks[chunk_index]
+        item = chunk.pop(offset)
+        self._len -= 1
+
+        if chunk:
+            self._tree_add(chunk_index, -1)
+        else:
+            del self._chunks[chunk_index]
+            self._build_tree()
+        return item
+
+    def popleft(self):
+        return self.pop(0)
+
+    def move(self, source: int, destination: int):
+        self.insert(destination, self.pop(source))
+
+    def clear(self):
+        self._rebuild([])
+
+    def shuffle(self):
+        items = list(self)
+        random.shuffle(items)
+        self._rebuild(items)
+
+    def remove_if(self, predicate) -> list:
+        """Removes every item matching `predicate` in a single pass and returns them"""
+        kept, removed = [], []
+        for item in self:
+            (removed if predicate(item) else kept).append(item)
+
+        if removed:
+            self._rebuild(kept)
+        return removed
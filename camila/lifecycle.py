@@ -0,0 +1,79 @@
+import logging
+import asyncio
+import collections
+
+
+class ResourceRegistry:
+    """
+    Tasks and child processes owned by each music player, so they can be released together
+    and counted to spot leaks. Finished tasks and exited processes are dropped on their own.
+    """
+
+    def __init__(self):
+        self._owners = set()
+        self._tasks = collections.defaultdict(set)
+        self._processes = collections.defaultdict(list)
+
+    def open(self, owner):
+        self._owners.add(owner)
+
+    def spawn(self, owner, coro) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        tasks = self._tasks[owner]
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return task
+
+    def add_process(self, owner, process):
+        """
+        Tracks a `subprocess.Popen` or an `asyncio.subprocess.Process`,
+        exited processes are pruned whenever processes are counted.
+        """
+        if process is not None:
+            self._processes[owner].append(process)
+
+    @staticmethod
+    def _is_running(process) -> bool:
+        # Popen finds out it exited by polling, the event loop tells the asyncio processes
+        if hasattr(process, "poll"):
+            return process.poll() is None
+        return process.returncode is None
+
+    def _live_processes(self, owner) -> list:
+        processes = [process for process in self._processes.get(owner, ()) if self._is_running(process)]
+        if processes:
+            self._processes[owner] = processes
+        else:
+            self._processes.pop(owner, None)
+        return processes
+
+    def cancel(self, owner) -> list:
+        """Cancels the tasks of `owner` and returns them, so they can be awaited"""
+        tasks = list(self._tasks.pop(owner, ()))
+        for task in tasks:
+            task.cancel()
+        return tasks
+
+    def release(self, owner):
+        """Forgets `owner`, killing the processes its sources should have already cleaned up"""
+        self._owners.discard(owner)
+        self.cancel(owner)
+
+        for process in self._live_processes(owner):
+            logging.warning(f"Killing leftover ffmpeg process {process.pid}")
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+        self._processes.pop(owner, None)
+
+    def counts(self) -> dict:
+        for owner in list(self._processes):
+            self._live_processes(owner)
+
+        return {
+            "states": len(self._owners),
+            "tasks": sum(len(tasks) for tasks in self._tasks.values()),
+            "processes": sum(len(processes) for processes in self._processes.values()),
+            "pids": [process.pid for processes in self._processes.values() for process in processes],
+        }
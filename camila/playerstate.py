@@ -0,0 +1,116 @@
+import json
+import time
+
+from camila.database import DatabaseConnector
+
+
+class PlayerStateStore:
+    """
+    Checkpoints of the music players kept in SQLite, so queues survive a restart of the bot.
+    Changed snapshots of every guild are written together in a single transaction and a queue
+    is only rewritten when its version changed since the last write.
+    """
+
+    def __init__(self, db: DatabaseConnector):
+        self.db = db
+        # Guild id -> (queue version, row) of the last written snapshot
+        self._written = {}
+
+    @staticmethod
+    def _row(snapshot: dict) -> tuple:
+        return (
+            snapshot["guild_id"],
+            snapshot["voice_channel_id"],
+            snapshot["volume"],
+            json.dumps(snapshot["current"]) if snapshot["current"] else None,
+            round(snapshot["position"], 1),
+        )
+
+    async def load(self) -> list:
+        """Returns the saved snapshots, each with its queue of track records in order"""
+        states = await self.db.fetchall(
+            "SELECT guild_id, voice_channel_id, volume, current, position FROM player_state"
+        )
+        tracks = await self.db.fetchall("SELECT guild_id, track FROM player_queue ORDER BY guild_id, idx")
+
+        queues = {}
+        for guild_id, track in tracks:
+            queues.setdefault(guild_id, []).append(json.loads(track))
+
+        return [
+            {
+                "guild_id": guild_id,
+                "voice_channel_id": voice_channel_id,
+                "volume": volume,
+                "current": json.loads(current) if current else None,
+                "position": position,
+                "queue": queues.get(guild_id, []),
+            }
+            for guild_id, voice_channel_id, volume, current, position in states
+        ]
+
+    def queue_written(self, guild_id: int, version: int) -> bool:
+        written = self._written.get(guild_id)
+        return written is not None and written[0] == version
+
+    async def save(self, snapshots: list):
+        """Writes the snapshots of active players which changed since the last call
+        and forgets guilds which are not among them anymore.
+        A snapshot carries its `queue` only when `queue_written` is False for its version"""
+        active = {snapshot["guild_id"] for snapshot in snapshots}
+        gone = [guild_id for guild_id in self._written if guild_id not in active]
+
+        changed = []
+        for snapshot in snapshots:
+            row = self._row(snapshot)
+            written = self._written.get(snapshot["guild_id"])
+            if written != (snapshot["version"], row):
+                changed.append((snapshot, row, snapshot["queue"] is not None))
+
+        if not changed and not gone:
+            return
+
+        now = int(time.time())
+
+        async def write(cursor):
+            await cursor.executemany(
+                """INSERT INTO player_state (guild_id, voice_channel_id, volume, current, position, updated)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (guild_id) DO UPDATE SET
+                    voice_channel_id = excluded.voice_channel_id,
+                    volume = excluded.volume,
+                    current = excluded.current,
+                    position = excluded.position,
+                    updated = excluded.updated""",
+                [row + (now,) for _, row, _ in changed],
+            )
+
+            for snapshot, _, queue_changed in changed:
+                if not queue_changed:
+                    continue
+
+                await cursor.execute("DELETE FROM player_queue WHERE guild_id = ?", (snapshot["guild_id"],))
+                await cursor.executemany(
+                    "INSERT INTO player_queue (guild_id, idx, track) VALUES (?, ?, ?)",
+                    [(snapshot["guild_id"], i, json.dumps(track)) for i, track in enumerate(snapshot["queue"])],
+                )
+
+            for guild_id in gone:
+                await cursor.execute("DELETE FROM player_state WHERE guild_id = ?", (guild_id,))
+                await cursor.execute("DELETE FROM player_queue WHERE guild_id = ?", (guild_id,))
+
+        await self.db.transaction(write)
+
+        for snapshot, row, _ in changed:
+            self._written[snapshot["guild_id"]] = (snapshot["version"], row)
+        for guild_id in gone:
+            del self._written[guild_id]
+
+    async def forget(self, guild_id: int):
+        self._written.pop(guild_id, None)
+
+        async def delete(cursor):
+            await cursor.execute("DELETE FROM player_state WHERE guild_id = ?", (guild_id,))
+            await cursor.execute("DELETE FROM player_queue WHERE guild_id = ?", (guild_id,))
+
+        await self.db.transaction(delete)
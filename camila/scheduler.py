@@ -0,0 +1,86 @@
+import asyncio
+import functools
+import collections
+
+from camila.exceptions import OverloadedError
+
+
+class RequestScheduler:
+    """
+    Admission control in front of expensive lookups.
+    Identical in-flight lookups share a single future, every guild runs at most
+    `per_guild` jobs at once and guilds with waiting jobs are served round-robin.
+    Once `max_pending` jobs are queued or running new ones are rejected right away.
+    """
+
+    def __init__(self, *, concurrency: int = 2, per_guild: int = 1, max_pending: int = 32):
+        self.concurrency = concurrency
+        self.per_guild = per_guild
+        self.max_pending = max_pending
+
+        self._inflight = {}
+        self._waiting = collections.OrderedDict()
+        self._running = collections.Counter()
+        self._active = 0
+        self._queued = 0
+
+    @property
+    def depth(self):
+        return self._active + self._queued
+
+    async def submit(self, guild_id: int, key: str, factory):
+        """Runs the coroutine returned by `factory` or joins an identical job that is already in flight"""
+        future = self._inflight.get(key)
+
+        if future is None:
+            if self.depth >= self.max_pending:
+                raise OverloadedError(f"Too many pending requests ({self.depth})")
+
+            future = asyncio.get_event_loop().create_future()
+            # Waiters may all be cancelled before the job finishes, don't warn about it then
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._inflight[key] = future
+
+            self._waiting.setdefault(guild_id, collections.deque()).append((key, factory, future))
+            self._queued += 1
+            self._dispatch()
+
+        # A cancelled waiter must not cancel the job shared with other waiters
+        return await asyncio.shield(future)
+
+    def _dispatch(self):
+        while self._active < self.concurrency and self._queued:
+            guild_id = next((g for g in self._waiting if self._running[g] < self.per_guild), None)
+            if guild_id is None:
+                return
+
+            jobs = self._waiting.pop(guild_id)
+            key, factory, future = jobs.popleft()
+            if jobs:
+                # Re-inserting puts the guild at the end of the round-robin order
+                self._waiting[guild_id] = jobs
+
+            self._queued -= 1
+            self._active += 1
+            self._running[guild_id] += 1
+
+            task = asyncio.ensure_future(factory())
+            task.add_done_callback(functools.partial(self._finish, guild_id, key, future))
+
+    def _finish(self, guild_id: int, key: str, future: asyncio.Future, task: asyncio.Task):
+        self._active -= 1
+        self._running[guild_id] -= 1
+        if not self._running[guild_id]:
+            del self._running[guild_id]
+
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+        self._dispatch()
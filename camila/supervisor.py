@@ -0,0 +1,157 @@
+import time
+import signal
+import asyncio
+import logging
+import collections
+
+import discord
+
+
+async def recommended_shards(token: str) -> int:
+    """Asks Discord how many shards the bot should be split into"""
+    http = discord.http.HTTPClient(loop=asyncio.get_event_loop())
+    try:
+        await http.static_login(token.strip(), bot=True)
+        shards, _ = await http.get_bot_gateway()
+    finally:
+        await http.close()
+
+    return shards
+
+
+class Supervisor:
+    """
+    Runs the bot in `workers` processes, each connected with its own share of the shards,
+    and starts a worker again when it crashes. Restarts back off exponentially and a worker
+    crashing more than `max_restarts` times within `restart_window` seconds is given up on.
+    """
+
+    def __init__(
+        self,
+        command: list,
+        *,
+        workers: int,
+        shard_count: int,
+        identify_interval: float = 5,
+        max_restarts: int = 5,
+        restart_window: float = 300,
+        max_backoff: float = 60,
+        stop_timeout: float = 30,
+    ):
+        self.command = command
+        self.shard_count = shard_count
+        self.identify_interval = identify_interval
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.max_backoff = max_backoff
+        self.stop_timeout = stop_timeout
+
+        self.shards = self.assign_shards(shard_count, workers)
+        self.failed = []
+
+        self._processes = {}
+        self._stopping = None
+        self._killer = None
+
+    @staticmethod
+    def assign_shards(shard_count: int, workers: int) -> list:
+        """Splits the shards into `workers` contiguous runs of almost the same length"""
+        return [list(range(i * shard_count // workers, (i + 1) * shard_count // workers)) for i in range(workers)]
+
+    async def run(self) -> int:
+        loop = asyncio.get_event_loop()
+        self._stopping = asyncio.Event()
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except NotImplementedError:
+                # Windows, the workers are stopped by the console themselves
+                pass
+
+        # Discord only lets one shard identify every few seconds, later workers wait for the earlier ones
+        watchers = []
+        delay = 0
+        for index, shard_ids in enumerate(self.shards):
+            watchers.append(loop.create_task(self.watch(index, shard_ids, delay)))
+            delay += len(shard_ids) * self.identify_interval
+
+        await asyncio.gather(*watchers)
+        if self._killer is not None:
+            self._killer.cancel()
+
+        return 1 if self.failed else 0
+
+    async def sleep(self, seconds: float) -> bool:
+        """Sleeps unless the supervisor is stopped first, returns False when it was"""
+        try:
+            await asyncio.wait_for(self._stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            return True
+        return False
+
+    async def watch(self, index: int, shard_ids: list, delay: float):
+        crashes = collections.deque()
+        if not await self.sleep(delay):
+            return
+
+        while not self._stopping.is_set():
+            process = await asyncio.create_subprocess_exec(
+                *self.command,
+                "--worker",
+                str(index),
+                "--shard-ids",
+                ",".join(map(str, shard_ids)),
+                "--shard-count",
+                str(self.shard_count),
+                # Signals from the terminal only reach the supervisor, it stops the workers itself
+                start_new_session=True,
+            )
+            self._processes[index] = process
+            logging.info(f"Worker {index} started with shards {shard_ids} (pid {process.pid})")
+
+            code = await process.wait()
+            del self._processes[index]
+
+            if self._stopping.is_set() or code == 0:
+                logging.info(f"Worker {index} stopped")
+                return
+
+            now = time.monotonic()
+            crashes.append(now)
+            while now - crashes[0] > self.restart_window:
+                crashes.popleft()
+
+            if len(crashes) > self.max_restarts:
+                logging.error(
+                    f"Worker {index} crashed {len(crashes)} times within {self.restart_window}s, "
+                    f"giving up on shards {shard_ids}"
+                )
+                self.failed.append(index)
+                return
+
+            backoff = min(self.max_backoff, 2 ** (len(crashes) - 1))
+            logging.warning(f"Worker {index} crashed with exit code {code}, restarting in {backoff}s")
+            if not await self.sleep(backoff):
+                return
+
+    def stop(self):
+        if self._stopping.is_set():
+            return
+
+        logging.info(f"Stopping {len(self._processes)} workers")
+        self._stopping.set()
+        for process in self._processes.values():
+            process.terminate()
+
+        self._killer = asyncio.get_event_loop().create_task(self.kill_stuck())
+
+    async def kill_stuck(self):
+        """Workers still running after `stop_timeout` seconds are killed"""
+        await asyncio.sleep(self.stop_timeout)
+        for index, process in list(self._processes.items()):
+            logging.warning(f"Worker {index} didn't stop in {self.stop_timeout}s, killing it")
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
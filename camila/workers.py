@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class WorkerPool:
+    """
+    Runs functions in a pool of spawned worker processes, every job with a timeout.
+    A job timing out or a worker dying replaces the pool, as does reaching `max_jobs` jobs.
+    A replaced pool finishes the jobs it is running, its processes are terminated once even
+    the last of them is past its timeout, so a hung worker never outlives the pool.
+    """
+
+    def __init__(
+        self, name: str, *, workers: int, timeout: float, max_jobs: int = None, initializer=None, initargs: tuple = ()
+    ):
+        self.name = name
+        self.workers = workers
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        self.initializer = initializer
+        self.initargs = initargs
+
+        self._pool = None
+        self._jobs = 0
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=self.initializer,
+            initargs=self.initargs,
+        )
+
+    def _recycle(self):
+        if self._pool is not None:
+            self._retire(self._pool, self.timeout)
+
+        self._pool = self._new_pool()
+        self._jobs = 0
+
+    def _retire(self, pool, grace: float = None):
+        """Shuts the pool down and terminates its processes after `grace` seconds, right away without it"""
+        # The executor forgets its processes on shutdown
+        processes = list((getattr(pool, "_processes", None) or {}).values())
+        pool.shutdown(wait=False)
+
+        if not processes:
+            return
+        if grace is None:
+            self._terminate(processes, hung=False)
+        else:
+            asyncio.get_event_loop().call_later(grace, self._terminate, processes)
+
+    def _terminate(self, processes: list, *, hung: bool = True):
+        for process in processes:
+            if process.is_alive():
+                if hung:
+                    logging.warning(f"{self.name} worker {process.pid} is still running, terminating it")
+                process.terminate()
+
+    async def run(self, func, *args, loop: asyncio.BaseEventLoop = None):
+        loop = loop or asyncio.get_event_loop()
+
+        if self._pool is None or (self.max_jobs is not None and self._jobs >= self.max_jobs):
+            self._recycle()
+
+        pool = self._pool
+        self._jobs += 1
+
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(pool, func, *args), self.timeout)
+        except (asyncio.TimeoutError, BrokenProcessPool) as e:
+            # A stuck or dead worker can't be reused, new jobs go to a fresh pool
+            logging.warning(f"{self.name} worker failed ({type(e).__name__}), recycling the pool")
+            if pool is self._pool:
+                self._recycle()
+            raise
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._retire(self._pool)
+            self._pool = None
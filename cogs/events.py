@@ -0,0 +1,229 @@
+import time
+import heapq
+import asyncio
+import logging
+import sqlite3
+
+import discord
+from discord.ext import commands
+
+from camila.constants import EVENTS_LOADED, EVENTS_DATE_FORMAT, EVENTS_TIMEZONE
+from camila.database import DatabaseConnector
+from camila.dates import parse_local, format_local
+
+# Seconds before the reminder task carries on after a failure
+REMINDER_RETRY = 5
+
+
+class Events(commands.Cog):
+    """
+    Add events for groups and get reminded about them when they start.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.db = None
+
+        # Min-heap of (date, guild ID, title) of the next upcoming events, only the nearest ones are loaded
+        self.heap = []
+        # (guild ID, title) -> date of the events in the heap, entries of removed or changed events are skipped
+        self.scheduled = {}
+        # (date, guild ID, title) of the last loaded event or None when every upcoming event is loaded
+        self.horizon = None
+        self.wake = asyncio.Event()
+
+        self.sleeper = None
+
+    def cog_unload(self):
+        if self.sleeper:
+            self.sleeper.cancel()
+
+    def cog_check(self, ctx: commands.Context):
+        if not ctx.guild:
+            raise commands.NoPrivateMessage("This command can't be used in DM channels.")
+
+        return True
+
+    @commands.Cog.listener()
+    async def on_database_ready(self, db: DatabaseConnector):
+        if self.db is not None:
+            return
+
+        self.db = db
+        (invalid,) = await self.db.fetchone("SELECT COUNT(*) FROM events_invalid")
+        if invalid:
+            logging.warning(f"{invalid} events with unreadable dates were kept aside in the events_invalid table")
+
+        await self.load_events((time.time(), 0, ""))
+        self.sleeper = self.bot.loop.create_task(self.reminder_task())
+
+    async def load_events(self, after: tuple):
+        """Loads the next batch of events following `after`, a (date, guild ID, title) key.
+        Events from before they had a guild and a channel have nowhere to be reminded in"""
+        rows = await self.db.fetchall(
+            """SELECT event_date, guild_id, event_title FROM events
+            WHERE (event_date, guild_id, event_title) > (?, ?, ?) AND channel_id IS NOT NULL
+            ORDER BY event_date, guild_id, event_title LIMIT ?""",
+            (int(after[0]), after[1], after[2], EVENTS_LOADED),
+        )
+
+        for date, guild_id, title in rows:
+            self.schedule(date, guild_id, title)
+        self.horizon = tuple(rows[-1]) if len(rows) == EVENTS_LOADED else None
+
+    def schedule(self, date: int, guild_id: int, title: str):
+        self.scheduled[guild_id, title] = date
+        heapq.heappush(self.heap, (date, guild_id, title))
+
+    def is_loaded(self, date: int, guild_id: int, title: str) -> bool:
+        return self.horizon is None or (date, guild_id, title) <= self.horizon
+
+    async def reminder_task(self):
+        """Sleeps until the nearest event, woken up early only when the nearest event changes"""
+        # Reminders are sent to channels, which are only known once the bot is ready
+        await self.bot.wait_until_ready()
+
+        while True:
+            try:
+                await self.remind_next()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The task is the only one sending reminders, it mustn't die with a single failure
+                logging.error(f"Reminder task failed, retrying in {REMINDER_RETRY}s: {type(e).__name__}: {e}")
+                await asyncio.sleep(REMINDER_RETRY)
+
+    async def remind_next(self):
+        """Waits for the nearest event and reminds about it, returns early when there is something else to do"""
+        self.wake.clear()
+
+        if not self.heap and self.horizon is not None:
+            await self.load_events(self.horizon)
+            return
+
+        delay = self.heap[0][0] - time.time() if self.heap else None
+        if delay is None or delay > 0:
+            try:
+                await asyncio.wait_for(self.wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            return
+
+        date, guild_id, title = heapq.heappop(self.heap)
+        if self.scheduled.get((guild_id, title)) != date:
+            return
+        del self.scheduled[guild_id, title]
+
+        try:
+            await self.remind(guild_id, title)
+        except (discord.HTTPException, sqlite3.Error) as e:
+            logging.warning(f"Reminder of event `{title}` failed: {e}")
+
+    async def remind(self, guild_id: int, title: str):
+        row = await self.db.fetchone(
+            "SELECT event_group, channel_id FROM events WHERE guild_id = ? AND event_title = ?",
+            (guild_id, title),
+        )
+        if row is None:
+            return
+
+        group, channel_id = row
+        channel = self.bot.get_channel(channel_id) if channel_id else None
+        if channel is None:
+            return
+
+        role = discord.utils.find(lambda r: r.name.lower() == group, channel.guild.roles)
+        mention = role.mention if role else f"**{group}**"
+        await channel.send(f"⏰ {mention} Wydarzenie **{title}** właśnie się zaczyna!")
+
+    @commands.group(invoke_without_command=True)
+    async def event(self, ctx: commands.Context):
+        """Manages events of groups, see !help event"""
+        await ctx.send_help(ctx.command)
+
+    @event.command(name="add")
+    async def event_add(self, ctx: commands.Context, group: str, day: str, hour: str, *, title: str):
+        """Adds an event for a group, the date is given as YYYY-MM-DD HH:MM.
+        The group is reminded in this channel when the event starts"""
+        group = group.lower()
+        if group not in [str(role).lower() for role in ctx.guild.roles]:
+            return await ctx.send("Wybrana grupa nie istnieje na serwerze!")
+
+        try:
+            date = parse_local(f"{day} {hour}", EVENTS_DATE_FORMAT)
+        except ValueError:
+            return await ctx.send("Data musi mieć format `RRRR-MM-DD GG:MM`!")
+
+        if date <= time.time():
+            return await ctx.send("Wydarzenie musi być w przyszłości!")
+
+        guild_id = ctx.guild.id
+        if await self.db.fetchone("SELECT 1 FROM events WHERE guild_id = ? AND event_title = ?", (guild_id, title)):
+            return await ctx.send(f"Wydarzenie **{title}** już istnieje!")
+
+        await self.db.execute(
+            """INSERT INTO events (guild_id, creator_id, event_title, event_date, event_group, channel_id)
+            VALUES (?, ?, ?, ?, ?, ?)""",
+            (guild_id, ctx.author.id, title, date, group, ctx.channel.id),
+        )
+
+        # Events past the loaded ones are picked up once the sleeper gets to them
+        if self.is_loaded(date, guild_id, title):
+            self.schedule(date, guild_id, title)
+            if self.heap[0] == (date, guild_id, title):
+                self.wake.set()
+
+        await ctx.send(f"📅 Dodano wydarzenie **{title}** dla grupy **{group}** ({day} {hour})")
+
+    @event.command(name="list")
+    async def event_list(self, ctx: commands.Context, group: str = None):
+        """Lists upcoming events of this server, optionally only the ones of a given group"""
+        now = int(time.time())
+        if group:
+            rows = await self.db.fetchall(
+                """SELECT event_date, event_title, event_group FROM events
+                WHERE guild_id = ? AND event_group = ? AND event_date > ? ORDER BY event_date LIMIT 10""",
+                (ctx.guild.id, group.lower(), now),
+            )
+        else:
+            rows = await self.db.fetchall(
+                """SELECT event_date, event_title, event_group FROM events
+                WHERE guild_id = ? AND event_date > ? ORDER BY event_date LIMIT 10""",
+                (ctx.guild.id, now),
+            )
+
+        if not rows:
+            return await ctx.send("Brak nadchodzących wydarzeń.")
+
+        lines = ""
+        for date, title, event_group in rows:
+            lines += f"`{format_local(date, EVENTS_DATE_FORMAT)}` **{title}** ({event_group})\n"
+        embed = discord.Embed(title="Nadchodzące wydarzenia", description=lines)
+        embed.set_footer(text=f"Strefa czasowa: {EVENTS_TIMEZONE}")
+        await ctx.send(embed=embed)
+
+    @event.command(name="remove")
+    async def event_remove(self, ctx: commands.Context, *, title: str):
+        """Removes an event of this server, only its creator or someone managing the server can"""
+        guild_id = ctx.guild.id
+        row = await self.db.fetchone(
+            "SELECT creator_id FROM events WHERE guild_id = ? AND event_title = ?", (guild_id, title)
+        )
+        if row is None:
+            return await ctx.send(f"Nie znaleziono wydarzenia **{title}**")
+        if row[0] != ctx.author.id and not ctx.author.guild_permissions.manage_guild:
+            return await ctx.send(f"{ctx.author.mention} Możesz usuwać tylko swoje wydarzenia!")
+
+        removed = await self.db.execute(
+            "DELETE FROM events WHERE guild_id = ? AND event_title = ?", (guild_id, title)
+        )
+        if not removed:
+            return await ctx.send(f"Nie znaleziono wydarzenia **{title}**")
+
+        # The heap entry is skipped once it comes up
+        self.scheduled.pop((guild_id, title), None)
+        await ctx.message.add_reaction("✅")
+
+
+def setup(bot):
+    bot.add_cog(Events(bot))
@@ -1,19 +1,196 @@
+import re
 import math
+import logging
+import time
+import sqlite3
 import asyncio
-import itertools
 import functools
+import collections
+import urllib.parse
 
-import youtube_dl
 import discord
 from discord.ext import commands
 from async_timeout import timeout
 
-from camila.exceptions import VoiceError, YTDLError
+from camila.constants import (
+    EXTRACTION_WORKERS,
+    EXTRACTION_TIMEOUT,
+    EXTRACTION_MAX_JOBS,
+    PREFETCH_TRACKS,
+    PREFETCH_REFRESH_BEFORE,
+    PREFETCH_RETRY_DELAY,
+    GAPLESS_PREWARM,
+    GAPLESS_BUFFER_FRAMES,
+    PLAYBACK_MODE,
+    AUDIO_CACHE_PATH,
+    AUDIO_CACHE_BUDGET,
+    AUDIO_CACHE_MIN_PLAYS,
+    RADIO_BUFFER_FRAMES,
+    PLAYLIST_MAX_SONGS,
+    PLAYLIST_BATCH,
+    SEARCH_RESULTS,
+    SEARCH_RESULTS_TTL,
+    SCHEDULER_PER_GUILD,
+    SCHEDULER_MAX_PENDING,
+    PLAYER_STATE_INTERVAL,
+    PLAYER_IDLE_TIMEOUT,
+    PLAYER_ALONE_TIMEOUT,
+    PLAYER_REAP_INTERVAL,
+)
+from camila.audio import FRAME_LENGTH, CachedOpusSource, DecodedOpusSource, PrebufferedSource, VolumeTransformer
+from camila.audiocache import OpusCache
+from camila.broadcast import Broadcast
+from camila.database import DatabaseConnector
+from camila.exceptions import VoiceError, YTDLError, OverloadedError
+from camila.extraction import ExtractionService
+from camila.indexedlist import IndexedList
+from camila.lifecycle import ResourceRegistry
+from camila.metrics import registry as metrics
+from camila.playerstate import PlayerStateStore
+from camila.scheduler import RequestScheduler
+
+extraction_seconds = metrics.histogram(
+    "camila_extraction_seconds", "Time spent resolving songs, by phase", ("phase",)
+)
+extraction_errors = metrics.counter(
+    "camila_extraction_errors_total", "Failed or timed out extractions, by phase", ("phase",)
+)
+extraction_cache = metrics.counter(
+    "camila_extraction_cache_total", "Lookups of resolved songs in the extraction cache", ("result",)
+)
+voice_transitions = metrics.counter(
+    "camila_voice_transitions_total", "Changes of the music players' state", ("transition",)
+)
+players_reaped = metrics.counter("camila_players_reaped_total", "Players closed by the reaper", ("reason",))
+song_start_seconds = metrics.histogram(
+    "camila_song_start_seconds", "Time from taking a song off the queue until it starts playing"
+)
+player_resources = metrics.gauge(
+    "camila_player_resources", "Live music players and the tasks and ffmpeg processes they own", ("resource",)
+)
+queue_length = metrics.gauge("camila_queue_length", "Songs queued in each guild", ("guild",))
+
+
+class ExtractionCache:
+    """
+    Bounded LRU cache of resolved youtube_dl info, keyed by normalized query and webpage URL.
+    Entries expire together with the signed stream URL they carry.
+    """
+
+    def __init__(self, maxsize: int = 256, *, default_ttl: int = 3600, margin: int = 120):
+        self.maxsize = maxsize
+        self.default_ttl = default_ttl
+        self.margin = margin
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def is_url(query: str) -> bool:
+        return urllib.parse.urlparse(query).scheme in ("http", "https")
+
+    @classmethod
+    def normalize(cls, query: str) -> str:
+        query = " ".join(query.split())
+        # Video IDs are case sensitive, only free text searches can be folded
+        return query if cls.is_url(query) else query.casefold()
+
+    @staticmethod
+    def stream_expiry(url: str):
+        """Returns the `expire` timestamp of a signed stream URL or None if it has none"""
+        if not url:
+            return None
+
+        parsed = urllib.parse.urlparse(url)
+        expire = urllib.parse.parse_qs(parsed.query).get("expire")
+        if expire:
+            return float(expire[0])
+
+        # Manifest URLs keep their parameters in the path
+        match = re.search(r"/expire/(\d+)", parsed.path)
+        if match:
+            return float(match.group(1))
+
+        return None
+
+    @classmethod
+    def expires_in(cls, url: str):
+        """Returns the seconds left until the stream URL expires or None if it doesn't expire"""
+        expires = cls.stream_expiry(url)
+        return None if expires is None else expires - time.time()
 
-youtube_dl.utils.bug_reports_message = lambda: ""
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
 
+        expires, info = entry
+        if expires <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
 
-class YTDLSource(discord.PCMVolumeTransformer):
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return info
+
+    def put(self, info: dict, *keys: str):
+        expires = self.stream_expiry(info.get("url")) or time.time() + self.default_ttl
+        expires -= self.margin
+
+        for key in keys:
+            self._entries[key] = (expires, info)
+            self._entries.move_to_end(key)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+class SearchIndex:
+    """
+    Persistent index of free text searches and the videos they resolved to.
+    Keeps at most `maxsize` queries, trimming the least recently used ones.
+    """
+
+    def __init__(self, maxsize: int = 5000):
+        self.maxsize = maxsize
+
+    async def lookup(self, db: DatabaseConnector, query: str):
+        row = await db.fetchone("SELECT webpage_url FROM search_index WHERE query = ?", (query,))
+        if row is None:
+            return None
+
+        db.write(
+            "UPDATE search_index SET hits = hits + 1, last_used = ? WHERE query = ?",
+            (int(time.time()), query),
+        )
+        return row[0]
+
+    def store(self, db: DatabaseConnector, query: str, video_id: str, webpage_url: str):
+        # Written behind, the song doesn't have to wait for the index
+        db.write(
+            """INSERT INTO search_index (query, video_id, webpage_url, hits, last_used)
+            VALUES (?, ?, ?, 0, ?)
+            ON CONFLICT (query) DO UPDATE SET
+                video_id = excluded.video_id,
+                webpage_url = excluded.webpage_url,
+                last_used = excluded.last_used""",
+            (query, video_id, webpage_url, int(time.time())),
+        )
+        db.write(
+            """DELETE FROM search_index WHERE query IN
+            (SELECT query FROM search_index ORDER BY last_used DESC LIMIT -1 OFFSET ?)""",
+            (self.maxsize,),
+        )
+
+
+class YTDLSource(VolumeTransformer):
     YTDL_OPTIONS = {
         "format": "bestaudio/best",
         "extractaudio": True,
@@ -35,80 +212,215 @@ class YTDLSource(discord.PCMVolumeTransformer):
         "options": "-vn",
     }
 
-    ytdl = youtube_dl.YoutubeDL(YTDL_OPTIONS)
+    # Only the fields a queued `Song` needs are sent back from the extraction workers
+    INFO_FIELDS = (
+        "id",
+        "title",
+        "uploader",
+        "uploader_url",
+        "duration",
+        "webpage_url",
+        "thumbnail",
+        "url",
+        "acodec",
+    )
+    FLAT_INFO_FIELDS = ("id", "title", "uploader", "duration", "webpage_url")
+
+    extractor = ExtractionService(
+        YTDL_OPTIONS,
+        workers=EXTRACTION_WORKERS,
+        timeout=EXTRACTION_TIMEOUT,
+        max_jobs=EXTRACTION_MAX_JOBS,
+    )
+    scheduler = RequestScheduler(
+        concurrency=EXTRACTION_WORKERS,
+        per_guild=SCHEDULER_PER_GUILD,
+        max_pending=SCHEDULER_MAX_PENDING,
+    )
+    cache = ExtractionCache(maxsize=256)
+    search_index = SearchIndex(maxsize=5000)
+    audio_cache = OpusCache(AUDIO_CACHE_PATH, budget=AUDIO_CACHE_BUDGET, min_plays=AUDIO_CACHE_MIN_PLAYS)
+
+    def __init__(self, song: "Song", *, volume: float = 0.5, path: str = None, start: float = 0):
+        audio = discord.FFmpegPCMAudio(
+            path or song.stream_url,
+            before_options=self.before_options(path, start),
+            options=self.FFMPEG_OPTIONS["options"],
+        )
+
+        super().__init__(audio, volume)
 
-    def __init__(
-        self,
+        self.song = song
+        self.frames = int(start / FRAME_LENGTH)
+
+    @property
+    def process(self):
+        return self.original._process
+
+    @classmethod
+    def before_options(cls, path: str = None, start: float = 0):
+        # Cached files are local, the reconnect options only apply to streams
+        options = "" if path else cls.FFMPEG_OPTIONS["before_options"]
+        if start > 0:
+            options += f" -ss {start:.2f}"
+        return options.strip() or None
+
+    @property
+    def position(self):
+        return self.frames * FRAME_LENGTH
+
+    def read(self):
+        self.frames += 1
+        return super().read()
+
+    @classmethod
+    async def create_source(
+        cls,
         ctx: commands.Context,
-        source: discord.FFmpegPCMAudio,
+        search: str,
         *,
-        data: dict,
-        volume: float = 0.5,
+        loop: asyncio.BaseEventLoop = None,
+        direct: bool = False,
     ):
-        super().__init__(source, volume)
+        """Resolves `search` into a queueable `Song`.
+        No ffmpeg process is started here, the audio source is created
+        by the voice state right before the song starts playing.
+        With `direct` the search is already a video URL and the flat lookup is skipped"""
+        loop = loop or asyncio.get_event_loop()
 
-        self.requester = ctx.author
-        self.channel = ctx.channel
-        self.data = data
+        key = cls.cache.normalize(search)
+        info = cls.cache.get(key)
+        if info is not None:
+            extraction_cache.labels("hit").inc()
+            return Song(ctx, info)
+        extraction_cache.labels("miss").inc()
 
-        self.uploader = data.get("uploader")
-        self.uploader_url = data.get("uploader_url")
-        date = data.get("upload_date")
-        self.upload_date = date[6:8] + "." + date[4:6] + "." + date[0:4]
-        self.title = data.get("title")
-        self.thumbnail = data.get("thumbnail")
-        self.description = data.get("description")
-        self.duration = self.parse_duration(int(data.get("duration")))
-        self.tags = data.get("tags")
-        self.url = data.get("webpage_url")
-        self.views = data.get("view_count")
-        self.likes = data.get("like_count")
-        self.dislikes = data.get("dislike_count")
-        self.stream_url = data.get("url")
+        db = getattr(ctx.bot, "db_holder", None)
+        resolve = functools.partial(cls.resolve_info, key, search, db=db, loop=loop, direct=direct)
+        # Includes the time spent waiting for a free extraction slot
+        with extraction_seconds.labels("resolve").time():
+            info = await cls.scheduler.submit(ctx.guild.id, key, resolve)
 
-    def __str__(self):
-        return f"**{self.title}** by **{self.uploader}**"
+        return Song(ctx, info)
 
     @classmethod
-    async def create_source(cls, ctx: commands.Context, search: str, *, loop: asyncio.BaseEventLoop = None):
+    async def resolve_info(
+        cls,
+        key: str,
+        search: str,
+        *,
+        db: DatabaseConnector,
+        loop: asyncio.BaseEventLoop,
+        direct: bool = False,
+    ):
+        is_search = not cls.cache.is_url(key)
+
+        webpage_url = search if direct else None
+        if webpage_url is None and is_search and db:
+            with extraction_seconds.labels("index").time():
+                webpage_url = await cls.search_index.lookup(db, key)
+
+        if webpage_url is None:
+            webpage_url = await cls.extract_flat(search, loop=loop)
+
+        info = cls.cache.get(webpage_url)
+        if info is None:
+            info = await cls.extract_full(webpage_url, loop=loop)
+
+        cls.cache.put(info, key, webpage_url, info["webpage_url"])
+        if is_search and db:
+            cls.search_index.store(db, key, info["id"], info["webpage_url"])
+
+        return info
+
+    @classmethod
+    async def refresh_song(cls, song: "Song", *, guild_id: int, margin: float, loop: asyncio.BaseEventLoop):
+        """Resolves a fresh stream URL for `song`, valid for at least `margin` more seconds"""
+        info = cls.cache.get(song.webpage_url)
+
+        if info is None or not Song.is_fresh(info.get("url"), margin):
+            resolve = functools.partial(cls.extract_full, song.webpage_url, loop=loop)
+            info = await cls.scheduler.submit(guild_id, song.webpage_url, resolve)
+            cls.cache.put(info, song.webpage_url)
+
+        song.update(info)
+
+    @classmethod
+    async def search(cls, ctx: commands.Context, query: str, *, limit: int, loop: asyncio.BaseEventLoop = None):
+        """Returns the top `limit` search results from the flat extraction only"""
         loop = loop or asyncio.get_event_loop()
 
-        partial = functools.partial(cls.ytdl.extract_info, search, download=False, process=False)
-        data = await loop.run_in_executor(None, partial)
+        search = f"ytsearch{limit}:{query}"
+        extract = functools.partial(cls.extractor.extract_flat, search, cls.FLAT_INFO_FIELDS, limit=limit, loop=loop)
+        try:
+            with extraction_seconds.labels("search").time():
+                entries = await cls.scheduler.submit(ctx.guild.id, cls.cache.normalize(search), extract)
+        except asyncio.TimeoutError:
+            extraction_errors.labels("search").inc()
+            raise YTDLError(f"Przekroczono czas wyszukiwania: `{query}`")
 
-        if data is None:
-            raise YTDLError(f"Nie znaleziono utworu: `{search}`")
+        return [entry for entry in entries if entry.get("webpage_url")]
 
-        if "entries" not in data:
-            process_info = data
-        else:
-            process_info = None
-            for entry in data["entries"]:
-                if entry:
-                    process_info = entry
-                    break
+    @classmethod
+    async def create_playlist(
+        cls,
+        ctx: commands.Context,
+        url: str,
+        *,
+        start: int,
+        limit: int,
+        loop: asyncio.BaseEventLoop = None,
+    ):
+        """Returns lightweight songs for `limit` entries of the playlist from `start` on and how many more it has.
+        Only the flat extraction is used, their stream URLs are resolved by the voice state shortly before they play"""
+        loop = loop or asyncio.get_event_loop()
 
-            if process_info is None:
-                raise YTDLError(f"Nie znaleziono utworu: `{search}`")
+        extract = functools.partial(
+            cls.extractor.extract_playlist, url, cls.FLAT_INFO_FIELDS, start=start, limit=limit, loop=loop
+        )
+        try:
+            with extraction_seconds.labels("playlist").time():
+                key = f"playlist:{start}:{limit}:{url}"
+                entries, remaining = await cls.scheduler.submit(ctx.guild.id, key, extract)
+        except asyncio.TimeoutError:
+            extraction_errors.labels("playlist").inc()
+            raise YTDLError(f"Przekroczono czas wczytywania playlisty: `{url}`")
 
-        webpage_url = process_info["webpage_url"]
-        partial = functools.partial(cls.ytdl.extract_info, webpage_url, download=False)
-        processed_info = await loop.run_in_executor(None, partial)
+        return [Song(ctx, entry) for entry in entries if entry.get("webpage_url")], remaining
 
-        if processed_info is None:
-            raise YTDLError(f"Nie udało się pobrać: `{webpage_url}`")
+    @classmethod
+    async def extract_flat(cls, search: str, *, loop: asyncio.BaseEventLoop):
+        try:
+            with extraction_seconds.labels("flat").time():
+                entries = await cls.extractor.extract_flat(search, cls.FLAT_INFO_FIELDS, loop=loop)
+        except asyncio.TimeoutError:
+            extraction_errors.labels("flat").inc()
+            raise YTDLError(f"Przekroczono czas wyszukiwania: `{search}`")
+        except YTDLError:
+            extraction_errors.labels("flat").inc()
+            raise
+
+        if not entries:
+            raise YTDLError(f"Nie znaleziono utworu: `{search}`")
 
-        if "entries" not in processed_info:
-            info = processed_info
-        else:
-            info = None
-            while info is None:
-                try:
-                    info = processed_info["entries"].pop(0)
-                except IndexError:
-                    raise YTDLError(f"Nie udało się pobrać żadnych plików dla `{webpage_url}`")
+        return entries[0]["webpage_url"]
+
+    @classmethod
+    async def extract_full(cls, webpage_url: str, *, loop: asyncio.BaseEventLoop):
+        try:
+            with extraction_seconds.labels("full").time():
+                info = await cls.extractor.extract_full(webpage_url, cls.INFO_FIELDS, loop=loop)
+        except asyncio.TimeoutError:
+            extraction_errors.labels("full").inc()
+            raise YTDLError(f"Przekroczono czas pobierania: `{webpage_url}`")
+        except YTDLError:
+            extraction_errors.labels("full").inc()
+            raise
+
+        if info is None:
+            raise YTDLError(f"Nie udało się pobrać: `{webpage_url}`")
 
-        return cls(ctx, discord.FFmpegPCMAudio(info["url"], **cls.FFMPEG_OPTIONS), data=info)
+        return info
 
     @staticmethod
     def parse_duration(duration: int):
@@ -129,69 +441,339 @@ class YTDLSource(discord.PCMVolumeTransformer):
         return ", ".join(duration)
 
 
+def is_unity(volume: float) -> bool:
+    """Whether the volume leaves the audio as it is, within what !volume can set"""
+    return abs(volume - 1.0) < 0.005
+
+
+class YTDLOpusSource(discord.FFmpegOpusAudio):
+    """
+    Plays a song as Opus packets produced by ffmpeg, skipping the PCM round trip through Python.
+    Volume is applied by an ffmpeg filter and Opus streams are copied as they are when no
+    volume change is needed.
+    """
+
+    def __init__(self, song: "Song", *, volume: float = 0.5, path: str = None, start: float = 0):
+        options = YTDLSource.FFMPEG_OPTIONS["options"]
+
+        if is_unity(volume) and (path or song.acodec == "opus"):
+            codec = "opus"
+        else:
+            codec = None
+            options += f" -af volume={volume:.2f}"
+
+        super().__init__(
+            path or song.stream_url,
+            codec=codec,
+            before_options=YTDLSource.before_options(path, start),
+            options=options,
+        )
+
+        self.song = song
+        self.frames = int(start / FRAME_LENGTH)
+
+    @property
+    def process(self):
+        return self._process
+
+    @property
+    def position(self):
+        return self.frames * FRAME_LENGTH
+
+    def read(self):
+        self.frames += 1
+        return super().read()
+
+
+class YTDLCachedSource(CachedOpusSource):
+    """
+    Plays a song from the on-disk Opus cache without starting ffmpeg.
+    """
+
+    def __init__(self, song: "Song", path: str, *, start: float = 0):
+        super().__init__(path, start=start)
+
+        self.song = song
+
+
+class YTDLCachedPCMSource(VolumeTransformer):
+    """
+    Plays a song from the on-disk Opus cache decoded in process, so its volume
+    can change live and its loudness is normalized, still without starting ffmpeg.
+    """
+
+    def __init__(self, song: "Song", path: str, *, volume: float = 0.5, start: float = 0):
+        self.cached = CachedOpusSource(path, start=start)
+        super().__init__(DecodedOpusSource(self.cached), volume)
+
+        self.song = song
+
+    @property
+    def process(self):
+        return None
+
+    @property
+    def position(self):
+        return self.cached.position
+
+
 class Song:
-    __slots__ = ("source", "requester")
+    __slots__ = (
+        "id",
+        "title",
+        "uploader",
+        "uploader_url",
+        "duration",
+        "webpage_url",
+        "thumbnail",
+        "stream_url",
+        "acodec",
+        "requester",
+        "channel",
+        "source",
+        "start",
+    )
+
+    def __init__(self, ctx: commands.Context, data: dict):
+        self.requester = ctx.author
+        self.channel = ctx.channel
+        self.source = None
+        # Seconds to skip when the song starts playing, set for songs restored mid-playback
+        self.start = 0
 
-    def __init__(self, source: YTDLSource):
-        self.source = source
-        self.requester = source.requester
+        self.update(data)
+
+    @classmethod
+    def from_record(cls, record: dict, *, requester: discord.Member, channel: discord.TextChannel):
+        """Recreates a song saved with `to_record`, without extracting it again"""
+        song = cls.__new__(cls)
+        song.requester = requester
+        song.channel = channel
+        song.source = None
+        song.start = 0
+
+        song.update(record)
+        return song
+
+    def to_record(self) -> dict:
+        """Compact record of the song, with the stream URL so it can still be played after a restart"""
+        return {
+            "id": self.id,
+            "title": self.title,
+            "uploader": self.uploader,
+            "uploader_url": self.uploader_url,
+            "duration": self.duration,
+            "webpage_url": self.webpage_url,
+            "thumbnail": self.thumbnail,
+            "url": self.stream_url,
+            "acodec": self.acodec,
+            "requester_id": self.requester.id,
+            "channel_id": self.channel.id,
+        }
+
+    def update(self, data: dict):
+        """Fills the song from extracted info, flat playlist entries only have some of the fields"""
+        self.id = data.get("id")
+        self.title = data.get("title")
+        self.uploader = data.get("uploader")
+        self.uploader_url = data.get("uploader_url")
+        self.duration = int(data.get("duration") or 0)
+        self.webpage_url = data.get("webpage_url")
+        self.thumbnail = data.get("thumbnail")
+        self.stream_url = data.get("url")
+        self.acodec = data.get("acodec")
+
+    def __str__(self):
+        return f"**{self.title}** by **{self.uploader}**"
+
+    @staticmethod
+    def is_fresh(stream_url: str, margin: float = 0) -> bool:
+        if stream_url is None:
+            return False
+
+        expires_in = ExtractionCache.expires_in(stream_url)
+        return expires_in is None or expires_in > margin
 
     def create_embed(self):
         embed = (
             discord.Embed(
                 title="Aktualny utwór",
-                description=f"```css\n{self.source.title}\n```",
+                description=f"```css\n{self.title}\n```",
                 color=discord.Color.gold(),
             )
-            .add_field(name="Długość", value=self.source.duration)
+            .add_field(name="Długość", value=YTDLSource.parse_duration(self.duration))
             .add_field(name="Dodane przez", value=self.requester.mention)
             .add_field(
                 name="Uploader",
-                value=f"[{self.source.uploader}]({self.source.uploader_url})",
+                value=f"[{self.uploader}]({self.uploader_url})",
             )
-            .add_field(name="URL", value=f"[{self.source.url}]({self.source.url})")
-            .set_thumbnail(url=self.source.thumbnail)
+            .add_field(name="URL", value=f"[{self.webpage_url}]({self.webpage_url})")
+            .set_thumbnail(url=self.thumbnail)
         )
 
         return embed
 
 
 class SongQueue(asyncio.Queue):
+    """
+    Queue of songs backed by an `IndexedList`, so positional operations stay O(log n)
+    even for playlist sized queues. A count of queued video IDs is kept alongside.
+    """
+
+    def _init(self, maxsize):
+        self._queue = IndexedList()
+        self._ids = collections.Counter()
+        # Set whenever the order of upcoming songs changes
+        self.changed = asyncio.Event()
+        # Bumped together with `changed`, so checkpoints can tell whether the queue was saved
+        self.version = 0
+
+    def _touch(self):
+        self.version += 1
+        self.changed.set()
+
+    def _put(self, item):
+        self._queue.append(item)
+        self._ids[item.id] += 1
+        self._touch()
+
+    def _get(self):
+        item = self._queue.popleft()
+        self._forget([item])
+        self._touch()
+        return item
+
+    def _forget(self, songs):
+        for song in songs:
+            self._ids[song.id] -= 1
+            if self._ids[song.id] <= 0:
+                del self._ids[song.id]
+
     def __getitem__(self, item):
-        if isinstance(item, slice):
-            return list(itertools.islice(self._queue, item.start, item.stop, item.step))
-        else:
-            return self._queue[item]
+        return self._queue[item]
 
     def __iter__(self):
-        return self._queue.__iter__()
+        return iter(self._queue)
 
     def __len__(self):
         return self.qsize()
 
+    def __contains__(self, video_id: str):
+        return self._ids[video_id] > 0
+
     def clear(self):
         self._queue.clear()
+        self._ids.clear()
+        self._touch()
 
     def remove(self, index: int):
-        del self._queue[index]
+        self._forget([self._queue.pop(index)])
+        self._touch()
+
+    def move(self, source: int, destination: int):
+        self._queue.move(source, destination)
+        self._touch()
+
+    def shuffle(self):
+        self._queue.shuffle()
+        self._touch()
+
+    def remove_where(self, predicate) -> int:
+        removed = self._queue.remove_if(predicate)
+        if removed:
+            self._forget(removed)
+            self._touch()
+        return len(removed)
+
+    def remove_requester(self, member: discord.Member) -> int:
+        return self.remove_where(lambda song: song.requester.id == member.id)
+
+    def dedupe(self) -> int:
+        """Removes repeated songs, keeping the first occurrence of each"""
+        if all(count == 1 for count in self._ids.values()):
+            return 0
+
+        seen = set()
+
+        def repeated(song):
+            if song.id in seen:
+                return True
+            seen.add(song.id)
+            return False
+
+        return self.remove_where(repeated)
 
 
 class VoiceState:
-    def __init__(self, bot: commands.Bot, ctx: commands.Context):
+    """
+    Music player of a single guild. Its background tasks only run between `start` and `close`,
+    they are tracked together with its ffmpeg processes in the shared registry.
+    """
+
+    # Radio name -> voice state of the guild broadcasting it
+    radios = {}
+    registry = ResourceRegistry()
+
+    def __init__(self, bot: commands.Bot, guild: discord.Guild):
         self.bot = bot
-        self._ctx = ctx
+        self.guild = guild
 
         self.current = None
-        self.voice = None
+        # Set once the player joined a channel, a player losing its voice client afterwards was disconnected
+        self.joined = False
+        self._voice = None
         self.next = asyncio.Event()
         self.songs = SongQueue()
 
-        self._volume = 0.5
+        # Opus mode plays songs at their own level by default, so cached files and Opus streams pass through untouched
+        self._volume = 0.5 if PLAYBACK_MODE == "pcm" else 1.0
 
-        self.audio_player = bot.loop.create_task(self.audio_player_task())
+        self.gapless = False
+        self._prewarmed = None
 
-    def __del__(self):
-        self.audio_player.cancel()
+        self.radio_name = None
+        self.radio_host = None
+        self.listeners = set()
+        self.broadcast = None
+        # Cleanups running in the executor, `close` waits for them before releasing the resources
+        self._cleanups = set()
+
+        # Updated by `expired`, when the player became idle or was left alone in the channel
+        self.idle_since = None
+        self.alone_since = None
+
+        self.audio_player = None
+        self.prefetcher = None
+
+    def start(self):
+        voice_transitions.labels("started").inc()
+        self.registry.open(self)
+        self.audio_player = self.registry.spawn(self, self.audio_player_task())
+        self.prefetcher = self.registry.spawn(self, self.prefetcher_task())
+
+    def cancel(self) -> list:
+        """Clears the queue and cancels the background tasks right away, returns the cancelled tasks"""
+        self.songs.clear()
+        self.discard_prewarmed()
+        self.leave_radio()
+        self.end_broadcast()
+
+        return self.registry.cancel(self)
+
+    async def close(self):
+        voice_transitions.labels("closed").inc()
+        tasks = self.cancel()
+
+        if self.voice:
+            # Stopping the voice client cleans up the source that is playing
+            await self.voice.disconnect()
+            self.voice = None
+        self.current = None
+
+        current_task = asyncio.current_task()
+        await asyncio.gather(*(task for task in tasks if task is not current_task), return_exceptions=True)
+        await asyncio.gather(*self._cleanups, return_exceptions=True)
+        self.registry.release(self)
 
     @property
     def volume(self):
@@ -201,47 +783,357 @@ class VoiceState:
     def volume(self, value: float):
         self._volume = value
 
+        self.apply_volume(self.current.source if self.current else None)
+        # The Opus decoder has the old volume baked into its filter, so it is started again later
+        if not self.apply_volume(self._prewarmed):
+            self.discard_prewarmed()
+
+    def apply_volume(self, source) -> bool:
+        """Changes the volume of an already created source, returns False when it can't be done live"""
+        if isinstance(source, PrebufferedSource):
+            source = source.original
+
+        if isinstance(source, VolumeTransformer):
+            source.volume = self._volume
+            return True
+
+        return False
+
+    @property
+    def voice(self):
+        return self._voice
+
+    @voice.setter
+    def voice(self, value: discord.VoiceClient):
+        self._voice = value
+        if value is not None:
+            self.joined = True
+
+    @property
+    def disconnected(self) -> bool:
+        """Whether the player was connected and lost its voice client since, a joining player isn't"""
+        return self.joined and (self.voice is None or not self.voice.is_connected())
+
     @property
     def is_playing(self):
         return self.voice and self.current
 
+    @property
+    def is_idle(self):
+        # Radio listeners have an empty queue of their own, they are busy while their host plays
+        if self.radio_host is not None:
+            return self.radio_host.broadcast is None
+        return self.current is None and len(self.songs) == 0
+
+    def expired(self, now: float):
+        """Returns why the player should be closed or None while it is still in use"""
+        if self.disconnected:
+            return "disconnected"
+
+        # A player still joining its channel, or which never joined one, is closed once idle for long enough
+        if self.voice is None or not all(member.bot for member in self.voice.channel.members):
+            self.alone_since = None
+        elif self.alone_since is None:
+            self.alone_since = now
+
+        if not self.is_idle:
+            self.idle_since = None
+        elif self.idle_since is None:
+            self.idle_since = now
+
+        if self.alone_since is not None and now - self.alone_since >= PLAYER_ALONE_TIMEOUT:
+            return "alone"
+        if self.idle_since is not None and now - self.idle_since >= PLAYER_IDLE_TIMEOUT:
+            return "idle"
+
+        return None
+
     async def audio_player_task(self):
         while True:
             self.next.clear()
+            self.current = None
 
-            # Try to get the next song within 3 minutes
-            # If no song will be added to the queue in time, the player will disconnect
+            # Leaving an idle channel is up to the reaper of the music cog
+            self.current = await self.songs.get()
             try:
-                async with timeout(180):
-                    self.current = await self.songs.get()
-            except asyncio.TimeoutError:
-                self.bot.loop.create_task(self.stop())
-                return
+                await self.play_current()
+            except (YTDLError, OverloadedError) as e:
+                voice_transitions.labels("song_failed").inc()
+                await self.current.channel.send(f"Nie udało się odtworzyć {self.current}: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # The player outlives any song, a failing one is skipped
+                logging.exception(f"Playing `{self.current.webpage_url}` in guild {self.guild.id} failed")
+                voice_transitions.labels("song_failed").inc()
+                self.abandon_current()
+
+    async def play_current(self):
+        dequeued = time.perf_counter()
+
+        if self.current.id not in YTDLSource.audio_cache and not Song.is_fresh(self.current.stream_url):
+            await self.refresh(self.current)
+
+        # The ffmpeg process is only spawned once the song is about to play
+        source = self.take_prewarmed(self.current) or self.create_source(self.current)
+        if source is None:
+            # Its cached file is gone and the stream URL was never resolved or expired
+            await self.refresh(self.current)
+            source = self.create_source(self.current)
+        self.current.source = source
+        self.current.start = 0
+        self.play_source(self.current.source)
+        song_start_seconds.observe(time.perf_counter() - dequeued)
+        voice_transitions.labels("song_started").inc()
+        await self.current.channel.send(embed=self.current.create_embed())
+
+        if YTDLSource.audio_cache.record_play(self.current.id):
+            self.registry.spawn(
+                self,
+                YTDLSource.audio_cache.store(
+                    self.current.id,
+                    self.current.stream_url,
+                    codec=self.current.acodec,
+                    before_options=YTDLSource.FFMPEG_OPTIONS["before_options"],
+                    on_process=lambda process: self.registry.add_process(self, process),
+                ),
+            )
+
+        await self.wait_for_song_end()
+        self.end_broadcast()
+        self.current.source = None
+
+    def abandon_current(self):
+        """Releases whatever the failed current song got to start"""
+        source, self.current.source = self.current.source, None
+        if self.voice and (self.voice.is_playing() or self.voice.is_paused()):
+            # Stopping the voice client cleans up the source that is playing
+            self.voice.stop()
+        elif source is not None:
+            self.cleanup_later(source.cleanup)
+        self.end_broadcast()
+
+    def play_source(self, source: discord.AudioSource):
+        if self.radio_name is None:
+            self.voice.play(source, after=self.play_next_song)
+            return
+
+        # A radio reads and encodes the song once and feeds every listening guild from it
+        self.broadcast = Broadcast(source, buffer=RADIO_BUFFER_FRAMES)
+        self.voice.play(self.broadcast.subscribe(), after=self.play_next_song)
+        for listener in self.listeners:
+            listener.tune_in(self.broadcast)
+        self.broadcast.start()
+
+    def end_broadcast(self):
+        if self.broadcast:
+            self.cleanup_later(self.broadcast.stop)
+            self.broadcast = None
+
+    def tune_in(self, broadcast: Broadcast):
+        if not self.voice:
+            return
 
-            self.current.source.volume = self._volume
-            self.voice.play(self.current.source, after=self.play_next_song)
-            await self.current.source.channel.send(embed=self.current.create_embed())
+        if self.voice.is_playing() or self.voice.is_paused():
+            self.voice.stop()
+        self.voice.play(broadcast.subscribe())
+
+    def start_radio(self, name: str):
+        self.leave_radio()
+        self.radio_name = name
+        VoiceState.radios[name] = self
+
+    def add_listener(self, listener: "VoiceState"):
+        listener.leave_radio()
+        listener.songs.clear()
+        listener.radio_host = self
+        self.listeners.add(listener)
+
+        if self.broadcast:
+            listener.tune_in(self.broadcast)
+        elif listener.voice and (listener.voice.is_playing() or listener.voice.is_paused()):
+            listener.voice.stop()
+
+    def leave_radio(self):
+        if self.radio_host:
+            self.radio_host.listeners.discard(self)
+            self.radio_host = None
+            if self.voice and (self.voice.is_playing() or self.voice.is_paused()):
+                self.voice.stop()
+
+        if self.radio_name:
+            VoiceState.radios.pop(self.radio_name, None)
+            self.radio_name = None
+            for listener in list(self.listeners):
+                listener.leave_radio()
+
+    def create_source(self, song: Song):
+        """Returns None when the song has to be refreshed first, its cached file vanished and the stream URL is stale"""
+        path = YTDLSource.audio_cache.get(song.id)
+
+        try:
+            if PLAYBACK_MODE == "opus":
+                if path and is_unity(self._volume):
+                    return YTDLCachedSource(song, path, start=song.start)
+            elif path:
+                return YTDLCachedPCMSource(song, path, volume=self._volume, start=song.start)
+        except FileNotFoundError:
+            # Another worker sharing the cache evicted the song since it was indexed
+            YTDLSource.audio_cache.forget(song.id)
+            if not Song.is_fresh(song.stream_url):
+                return None
+            path = None
+
+        if PLAYBACK_MODE == "opus":
+            source = YTDLOpusSource(song, volume=self._volume, path=path, start=song.start)
+        else:
+            source = YTDLSource(song, volume=self._volume, path=path, start=song.start)
+
+        self.registry.add_process(self, source.process)
+        return source
+
+    async def wait_for_song_end(self):
+        if self.gapless and self.current.duration:
+            # Wake up a few seconds before the end to start the decoder of the next song.
+            # Pausing moves the end further away, so the remaining time is checked again
+            while not self.next.is_set():
+                remaining = self.current.duration - self.current.source.position - GAPLESS_PREWARM
+                if remaining <= 0:
+                    self.prewarm_next()
+                    break
 
-            await self.next.wait()
+                try:
+                    async with timeout(remaining):
+                        await self.next.wait()
+                except asyncio.TimeoutError:
+                    pass
+
+        await self.next.wait()
+
+    def prewarm_next(self):
+        if len(self.songs) == 0:
+            return
+
+        song = self.songs[0]
+        if self._prewarmed and self._prewarmed.song is song:
+            return
+
+        self.discard_prewarmed()
+        # A stale URL is left to the player, which refreshes it before playing
+        if song.id in YTDLSource.audio_cache or Song.is_fresh(song.stream_url):
+            source = self.create_source(song)
+            if source is not None:
+                self._prewarmed = PrebufferedSource(source, frames=GAPLESS_BUFFER_FRAMES)
+
+    def take_prewarmed(self, song: Song):
+        prewarmed, self._prewarmed = self._prewarmed, None
+        if prewarmed and prewarmed.song is song:
+            return prewarmed
+
+        if prewarmed:
+            self.cleanup_later(prewarmed.cleanup)
+        return None
+
+    def discard_prewarmed(self):
+        if self._prewarmed:
+            self.cleanup_later(self._prewarmed.cleanup)
+            self._prewarmed = None
+
+    def cleanup_later(self, cleanup):
+        """Runs `cleanup` in the executor, joining reader threads and reaping ffmpeg would block the loop"""
+        future = self.bot.loop.run_in_executor(None, cleanup)
+        self._cleanups.add(future)
+        future.add_done_callback(self._cleanup_done)
+
+    def _cleanup_done(self, future: asyncio.Future):
+        self._cleanups.discard(future)
+        if not future.cancelled() and future.exception():
+            logging.error("Cleaning up a source failed", exc_info=future.exception())
+
+    async def refresh(self, song: Song):
+        await YTDLSource.refresh_song(
+            song,
+            guild_id=self.guild.id,
+            margin=PREFETCH_REFRESH_BEFORE,
+            loop=self.bot.loop,
+        )
+
+    async def prefetcher_task(self):
+        """Keeps stream URLs of the next few songs resolved and refreshes them before they expire.
+        Prefetched URLs live on the queued songs, so they go away together with removed songs"""
+        while True:
+            self.songs.changed.clear()
+            wait = PREFETCH_REFRESH_BEFORE
+
+            # The pre-warmed decoder is only useful while its song is still the next one
+            if self._prewarmed and (len(self.songs) == 0 or self.songs[0] is not self._prewarmed.song):
+                self.discard_prewarmed()
+
+            for song in self.songs[:PREFETCH_TRACKS]:
+                if song.id in YTDLSource.audio_cache:
+                    continue
+
+                if not Song.is_fresh(song.stream_url, PREFETCH_REFRESH_BEFORE):
+                    try:
+                        await self.refresh(song)
+                    except (YTDLError, OverloadedError) as e:
+                        logging.warning(f"Prefetching `{song.webpage_url}` failed: {e}")
+                        wait = min(wait, PREFETCH_RETRY_DELAY)
+                        continue
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception:
+                        # Retried later like any failed prefetch, the player refreshes the song itself anyway
+                        logging.exception(f"Prefetching `{song.webpage_url}` failed")
+                        wait = min(wait, PREFETCH_RETRY_DELAY)
+                        continue
+
+                expires_in = ExtractionCache.expires_in(song.stream_url)
+                if expires_in is not None:
+                    wait = min(wait, max(expires_in - PREFETCH_REFRESH_BEFORE, PREFETCH_RETRY_DELAY))
+
+            try:
+                async with timeout(wait):
+                    await self.songs.changed.wait()
+            except asyncio.TimeoutError:
+                pass
+
+    def snapshot(self, store: PlayerStateStore):
+        """Returns the state to checkpoint or None when there is nothing worth restoring.
+        Track records of the queue are only built when the store doesn't have its version yet"""
+        if not self.voice or self.radio_host or (not self.current and len(self.songs) == 0):
+            return None
+
+        position = 0
+        if self.current:
+            position = self.current.source.position if self.current.source else self.current.start
+
+        queue = None
+        if not store.queue_written(self.guild.id, self.songs.version):
+            queue = [song.to_record() for song in self.songs]
+
+        return {
+            "guild_id": self.guild.id,
+            "voice_channel_id": self.voice.channel.id,
+            "volume": self._volume,
+            "current": self.current.to_record() if self.current else None,
+            "position": position,
+            "version": self.songs.version,
+            "queue": queue,
+        }
 
     def play_next_song(self, error=None):
         if error:
             raise VoiceError(f"Error while trying to play next song: {error}")
 
-        self.next.set()
+        # Called from the audio player thread, the event loop has to be woken up explicitly
+        self.bot.loop.call_soon_threadsafe(self.next.set)
 
     def skip(self):
         if self.is_playing:
+            voice_transitions.labels("skipped").inc()
             self.voice.stop()
 
-    async def stop(self):
-        self.songs.clear()
-
-        if self.voice:
-            await self.voice.disconnect()
-            self.voice = None
-            self.current = None
-
 
 class Music(commands.Cog):
     """
@@ -251,19 +1143,180 @@ class Music(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.voice_states = {}
+        # (guild id, author id) -> (expiry time, candidates of their last !search)
+        self.search_results = {}
+
+        self.player_store = None
+        self.checkpointer = None
+        self.reaper = bot.loop.create_task(self.reaper_task())
+        # Songs count as not cached until the cache directory was read
+        bot.loop.create_task(YTDLSource.audio_cache.load())
+
+        # Read only when the metrics are scraped
+        player_resources.set_function(self.count_resources)
+        queue_length.set_function(lambda: {guild_id: len(state.songs) for guild_id, state in self.voice_states.items()})
 
-    def get_voice_state(self, ctx: commands.Context):
+    @staticmethod
+    def count_resources() -> dict:
+        counts = VoiceState.registry.counts()
+        return {resource: counts[resource] for resource in ("states", "tasks", "processes")}
+
+    async def get_voice_state(self, ctx: commands.Context):
         state = self.voice_states.get(ctx.guild.id)
+        if state is not None and not state.disconnected:
+            return state
 
-        if not state or (state and not state.voice):
-            state = VoiceState(self.bot, ctx)
-            self.voice_states[ctx.guild.id] = state
+        # The replacement is stored before the old state is closed, so commands arriving meanwhile share it
+        stale, state = state, VoiceState(self.bot, ctx.guild)
+        state.start()
+        self.voice_states[ctx.guild.id] = state
 
+        if stale is not None:
+            await stale.close()
         return state
 
     def cog_unload(self):
+        # Stopping the players below must not reach the checkpoints, they are restored on the next start
+        if self.checkpointer:
+            self.checkpointer.cancel()
+        self.reaper.cancel()
+
+        player_resources.set_function(None)
+        queue_length.set_function(None)
+
+        # Unloading can't wait, the tasks are cancelled now and the voice clients disconnect afterwards
         for state in self.voice_states.values():
-            self.bot.loop.create_task(state.stop())
+            state.cancel()
+            self.bot.loop.create_task(state.close())
+        self.voice_states.clear()
+
+        YTDLSource.extractor.shutdown()
+
+    @commands.Cog.listener()
+    async def on_database_ready(self, db: DatabaseConnector):
+        if self.player_store is not None:
+            return
+
+        self.player_store = PlayerStateStore(db)
+        saved_players = await self.player_store.load()
+
+        # The database is opened before connecting, the guilds are only known once the bot is ready
+        await self.bot.wait_until_ready()
+        for saved in saved_players:
+            # Players of guilds on the shards of other workers are theirs to restore
+            if not self.bot.owns_guild(saved["guild_id"]):
+                continue
+
+            try:
+                restored = await self.restore_player(saved)
+            except (discord.DiscordException, asyncio.TimeoutError) as e:
+                logging.warning(f"Restoring the player of guild {saved['guild_id']} failed: {e}")
+                restored = False
+
+            if not restored:
+                await self.player_store.forget(saved["guild_id"])
+
+        self.checkpointer = self.bot.loop.create_task(self.checkpoint_task())
+
+    async def restore_player(self, saved: dict) -> bool:
+        """Reconnects to the saved voice channel and queues the saved songs again.
+        The current song resumes from the saved position, songs which are cached or still have
+        a fresh stream URL play without any extraction"""
+        guild = self.bot.get_guild(saved["guild_id"])
+        channel = guild and guild.get_channel(saved["voice_channel_id"])
+        if not isinstance(channel, discord.VoiceChannel) or not any(not m.bot for m in channel.members):
+            return False
+
+        members = {}
+
+        async def restore_song(record: dict):
+            text_channel = guild.get_channel(record["channel_id"])
+            if text_channel is None:
+                return None
+
+            requester_id = record["requester_id"]
+            if requester_id not in members:
+                members[requester_id] = await self.fetch_member(guild, requester_id)
+
+            return Song.from_record(record, requester=members[requester_id], channel=text_channel)
+
+        songs = []
+        if saved["current"]:
+            current = await restore_song(saved["current"])
+            if current:
+                current.start = saved["position"]
+                songs.append(current)
+
+        for record in saved["queue"]:
+            song = await restore_song(record)
+            if song:
+                songs.append(song)
+
+        if not songs:
+            return False
+
+        state = VoiceState(self.bot, guild)
+        state.volume = saved["volume"]
+        state.voice = await channel.connect()
+        state.start()
+        for song in songs:
+            state.songs.put_nowait(song)
+
+        self.voice_states[guild.id] = state
+        voice_transitions.labels("restored").inc()
+        logging.info(f"Restored the player of guild {guild.id} with {len(songs)} songs")
+        return True
+
+    @staticmethod
+    async def fetch_member(guild: discord.Guild, member_id: int):
+        member = guild.get_member(member_id)
+        if member is None:
+            try:
+                member = await guild.fetch_member(member_id)
+            except discord.HTTPException:
+                # Songs of members who left are attributed to the bot
+                member = guild.me
+
+        return member
+
+    async def checkpoint_task(self):
+        """Periodically writes the changed player states in one batch"""
+        while True:
+            await asyncio.sleep(PLAYER_STATE_INTERVAL)
+
+            snapshots = [state.snapshot(self.player_store) for state in self.voice_states.values()]
+            try:
+                await self.player_store.save([snapshot for snapshot in snapshots if snapshot])
+            except sqlite3.Error as e:
+                logging.warning(f"Saving player states failed: {e}")
+
+    async def reaper_task(self):
+        """Closes players which were disconnected, left alone or idle for too long
+        and logs the live states, tasks and ffmpeg processes whenever they change"""
+        last_counts = None
+        while True:
+            await asyncio.sleep(PLAYER_REAP_INTERVAL)
+
+            now = time.monotonic()
+            for guild_id, state in list(self.voice_states.items()):
+                reason = state.expired(now)
+                if reason is None:
+                    continue
+
+                # The state may have been replaced while an earlier one was closing
+                if self.voice_states.get(guild_id) is state:
+                    del self.voice_states[guild_id]
+                await state.close()
+                players_reaped.labels(reason).inc()
+                logging.info(f"Closed the player of guild {guild_id}: {reason}")
+
+            counts = VoiceState.registry.counts()
+            if counts != last_counts:
+                logging.info(
+                    f"Live players: {counts['states']}, tasks: {counts['tasks']}, "
+                    f"ffmpeg processes: {counts['processes']} {counts['pids']}"
+                )
+                last_counts = counts
 
     def cog_check(self, ctx: commands.Context):
         if not ctx.guild:
@@ -272,7 +1325,7 @@ class Music(commands.Cog):
         return True
 
     async def cog_before_invoke(self, ctx: commands.Context):
-        ctx.voice_state = self.get_voice_state(ctx)
+        ctx.voice_state = await self.get_voice_state(ctx)
 
     @commands.command()
     async def join(self, ctx: commands.Context):
@@ -291,8 +1344,8 @@ class Music(commands.Cog):
         if not ctx.voice_state.voice:
             return await ctx.send("Nie jestem połączona z żadnym kanałem głosowym!")
 
-        await ctx.voice_state.stop()
         del self.voice_states[ctx.guild.id]
+        await ctx.voice_state.close()
 
     @commands.command()
     async def volume(self, ctx: commands.Context, *, volume: int):
@@ -300,17 +1353,32 @@ class Music(commands.Cog):
         if not ctx.voice_state.is_playing:
             return await ctx.send("Nie mogę zmienić głośności kiedy nic nie gra!")
 
-        if 0 > volume > 100:
+        if not 0 <= volume <= 100:
             return await ctx.send("Glośność musi być między 0 a 100")
 
         ctx.voice_state.volume = volume / 100
-        await ctx.send(f"🔊 Głośność od następnego utworu będzie ustawiona na {volume}%")
+        if ctx.voice_state.apply_volume(ctx.voice_state.current.source):
+            await ctx.send(f"🔊 Głośność ustawiona na {volume}%")
+        else:
+            await ctx.send(f"🔊 Głośność od następnego utworu będzie ustawiona na {volume}%")
+
+    @commands.command()
+    async def gapless(self, ctx: commands.Context):
+        """Toggles gapless playback between songs"""
+        ctx.voice_state.gapless = not ctx.voice_state.gapless
+
+        if ctx.voice_state.gapless:
+            await ctx.send("⏩ Płynne przejścia między utworami włączone")
+        else:
+            ctx.voice_state.discard_prewarmed()
+            await ctx.send("⏩ Płynne przejścia między utworami wyłączone")
 
     @commands.command(aliases=["current", "playing"])
     async def now(self, ctx: commands.Context):
         """Displays the currently playing song"""
-        if ctx.voice_state.current:
-            await ctx.send(embed=ctx.voice_state.current.create_embed())
+        state = ctx.voice_state.radio_host or ctx.voice_state
+        if state.current:
+            await ctx.send(embed=state.current.create_embed())
         else:
             await ctx.send("Aktualnie nic nie gra.")
 
@@ -353,7 +1421,7 @@ class Music(commands.Cog):
 
         queue = ""
         for i, song in enumerate(ctx.voice_state.songs[start:end], start=start):
-            queue += f"`{i + 1}.` [**{song.source.title}**]({song.source.url})\n"
+            queue += f"`{i + 1}.` [**{song.title}**]({song.webpage_url})\n"
 
         embed = discord.Embed(description=f"**{len(ctx.voice_state.songs)} tracks:**\n\n{queue}").set_footer(
             text=f"Viewing page {page}/{pages}"
@@ -370,6 +1438,37 @@ class Music(commands.Cog):
         ctx.voice_state.songs.remove(index - 1)
         await ctx.message.add_reaction("✅")
 
+    @commands.command()
+    async def move(self, ctx: commands.Context, source: int, destination: int):
+        """Moves a song in the queue from one position to another"""
+        songs = ctx.voice_state.songs
+        if not (1 <= source <= len(songs) and 1 <= destination <= len(songs)):
+            return await ctx.send(f"Pozycje muszą być między 1 a {len(songs)}")
+
+        songs.move(source - 1, destination - 1)
+        await ctx.message.add_reaction("✅")
+
+    @commands.command()
+    async def shuffle(self, ctx: commands.Context):
+        """Shuffles the queue"""
+        if len(ctx.voice_state.songs) == 0:
+            return await ctx.send("Kolejka jest pusta.")
+
+        ctx.voice_state.songs.shuffle()
+        await ctx.message.add_reaction("🔀")
+
+    @commands.command()
+    async def dedupe(self, ctx: commands.Context):
+        """Removes repeated songs from the queue"""
+        removed = ctx.voice_state.songs.dedupe()
+        await ctx.send(f"Usunięto {removed} powtórzonych utworów z kolejki")
+
+    @commands.command()
+    async def removeuser(self, ctx: commands.Context, member: discord.Member):
+        """Removes every song queued by a given member"""
+        removed = ctx.voice_state.songs.remove_requester(member)
+        await ctx.send(f"Usunięto {removed} utworów dodanych przez {member.display_name}")
+
     @commands.command()
     async def play(self, ctx: commands.Context, *, search: str):
         """Plays a song.
@@ -381,19 +1480,157 @@ class Music(commands.Cog):
         if not ctx.voice_state.voice:
             await ctx.invoke(self.join)
 
+        if ctx.voice_state.radio_host:
+            return await ctx.send("Słuchasz teraz radia, najpierw użyj `!radio leave`.")
+
+        # A number picks one of the candidates from the author's last !search
+        candidate = self.get_search_result(ctx, search)
+        if candidate is not None:
+            search = candidate["webpage_url"]
+
         async with ctx.typing():
             try:
-                source = await YTDLSource.create_source(ctx, search, loop=self.bot.loop)
+                song = await YTDLSource.create_source(ctx, search, loop=self.bot.loop, direct=candidate is not None)
             except YTDLError as e:
                 await ctx.send("An error occurred while processing this request: {}".format(str(e)))
+            except OverloadedError:
+                await ctx.send("Mam teraz za dużo zapytań, spróbuj ponownie za chwilę.")
             else:
-                song = Song(source)
-
                 await ctx.voice_state.songs.put(song)
-                await ctx.send(f"Dodano do kolejki {source}")
+                await ctx.send(f"Dodano do kolejki {song}")
+
+    def get_search_result(self, ctx: commands.Context, search: str):
+        if not search.strip().isdigit():
+            return None
+
+        expires, results = self.search_results.get((ctx.guild.id, ctx.author.id), (0, []))
+        index = int(search) - 1
+        if expires < time.time() or not 0 <= index < len(results):
+            return None
+
+        return results[index]
+
+    @commands.command()
+    async def search(self, ctx: commands.Context, *, query: str):
+        """Lists the top search results for a query.
+        Pick one of them with !play <number>"""
+        async with ctx.typing():
+            try:
+                results = await YTDLSource.search(ctx, query, limit=SEARCH_RESULTS, loop=self.bot.loop)
+            except YTDLError as e:
+                return await ctx.send("An error occurred while processing this request: {}".format(str(e)))
+            except OverloadedError:
+                return await ctx.send("Mam teraz za dużo zapytań, spróbuj ponownie za chwilę.")
+
+        if not results:
+            return await ctx.send(f"Nie znaleziono utworu: `{query}`")
+
+        now = time.time()
+        self.search_results = {key: value for key, value in self.search_results.items() if value[0] > now}
+        self.search_results[(ctx.guild.id, ctx.author.id)] = (now + SEARCH_RESULTS_TTL, results)
+
+        lines = ""
+        for i, result in enumerate(results, start=1):
+            duration = YTDLSource.parse_duration(int(result.get("duration") or 0)) or "?"
+            lines += f"`{i}.` [**{result.get('title')}**]({result['webpage_url']}) ({duration})\n"
+
+        embed = discord.Embed(title="Wyniki wyszukiwania", description=lines).set_footer(
+            text="Wybierz utwór komendą !play <numer>"
+        )
+        await ctx.send(embed=embed)
+
+    @commands.command()
+    async def playlist(self, ctx: commands.Context, *, url: str):
+        """Queues every song of a playlist.
+        The first song is queued right away, the rest of the playlist is loaded in the background
+        a page at a time, up to the limit of the bot. Songs are only fully resolved shortly before they play"""
+        if not ctx.voice_state.voice:
+            await ctx.invoke(self.join)
+
+        if ctx.voice_state.radio_host:
+            return await ctx.send("Słuchasz teraz radia, najpierw użyj `!radio leave`.")
+
+        try:
+            async with ctx.typing():
+                first, remaining = await YTDLSource.create_playlist(ctx, url, start=0, limit=1, loop=self.bot.loop)
+        except YTDLError as e:
+            return await ctx.send("An error occurred while processing this request: {}".format(str(e)))
+        except OverloadedError:
+            return await ctx.send("Mam teraz za dużo zapytań, spróbuj ponownie za chwilę.")
+
+        if not first and remaining == 0:
+            return await ctx.send(f"Nie znaleziono utworów w playliście: `{url}`")
+
+        state = ctx.voice_state
+        for song in first:
+            state.songs.put_nowait(song)
+
+        if remaining == 0:
+            return await ctx.send(f"Dodano do kolejki {first[0]}")
+
+        if first:
+            await ctx.send(f"Dodano do kolejki {first[0]}, wczytuję resztę playlisty...")
+        # Cancelled together with the player, when it's closed meanwhile
+        state.registry.spawn(state, self.queue_playlist(ctx, state, url, queued=len(first)))
+
+    async def queue_playlist(self, ctx: commands.Context, state: "VoiceState", url: str, *, queued: int):
+        """Queues the playlist past its first entry, every page is a job of its own and queued as it arrives"""
+        start, remaining = 1, None
+        try:
+            while remaining != 0 and start < PLAYLIST_MAX_SONGS:
+                limit = min(PLAYLIST_BATCH - start % PLAYLIST_BATCH, PLAYLIST_MAX_SONGS - start)
+                songs, remaining = await YTDLSource.create_playlist(
+                    ctx, url, start=start, limit=limit, loop=self.bot.loop
+                )
+                for song in songs:
+                    state.songs.put_nowait(song)
+                queued += len(songs)
+                start += limit
+        except YTDLError as e:
+            return await ctx.send(f"Dodano {queued} utworów z playlisty, reszty nie udało się wczytać: {e}")
+        except OverloadedError:
+            return await ctx.send(f"Dodano {queued} utworów z playlisty, na resztę mam teraz za dużo zapytań.")
+
+        message = f"Dodano {queued} utworów z playlisty"
+        if remaining is None:
+            message += f", ma ona więcej niż {PLAYLIST_MAX_SONGS} utworów i pozostałe pominięto"
+        elif remaining:
+            message += f", pominięto {remaining} utworów ponad limit {PLAYLIST_MAX_SONGS}"
+        await ctx.send(message)
+
+    @commands.group(invoke_without_command=True)
+    async def radio(self, ctx: commands.Context, *, name: str):
+        """Broadcasts this server's music as a radio or tunes in to one.
+        The first server to use a radio name becomes its host, its queue is played
+        on every server that tunes in afterwards. A sharded bot keeps radios per worker,
+        only servers served by the same worker as the host can tune in"""
+        if not ctx.voice_state.voice:
+            await ctx.invoke(self.join)
+
+        host = VoiceState.radios.get(name)
+        if host is ctx.voice_state:
+            return await ctx.send(f"📻 Radio `{name}` już nadaje z tego serwera.")
+
+        if host is None:
+            ctx.voice_state.start_radio(name)
+            await ctx.send(f"📻 Radio `{name}` nadaje z tego serwera!")
+        else:
+            host.add_listener(ctx.voice_state)
+            await ctx.send(f"📻 Słuchasz radia `{name}`")
+
+    @radio.command(name="leave")
+    async def radio_leave(self, ctx: commands.Context):
+        """Stops broadcasting or listening to a radio"""
+        if not ctx.voice_state.radio_name and not ctx.voice_state.radio_host:
+            return await ctx.send("Nie nadaję ani nie słucham żadnego radia.")
+
+        ctx.voice_state.leave_radio()
+        await ctx.message.add_reaction("✅")
 
     @join.before_invoke
     @play.before_invoke
+    @playlist.before_invoke
+    @radio.before_invoke
     async def ensure_voice_state(self, ctx: commands.Context):
         if not ctx.author.voice or not ctx.author.voice.channel:
             return await ctx.send("Nie jesteś połączony z żadnym kanałem głosowym!")
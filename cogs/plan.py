@@ -1,11 +1,33 @@
 import os
+import time
+import asyncio
 import logging
+import collections
+import urllib.parse
 from pathlib import Path
+from concurrent.futures.process import BrokenProcessPool
 
-import requests
+import aiohttp
 import discord
 from discord.ext import commands
 
+from camila.constants import (
+    PLAN_PATH,
+    PLAN_MAX_SIZE,
+    PLAN_DOWNLOAD_TIMEOUT,
+    PLAN_FORMAT,
+    PLAN_MAX_RESOLUTION,
+    PLAN_PREVIEW_RESOLUTION,
+    PLAN_PROCESS_TIMEOUT,
+    PLAN_REFRESH_INTERVAL,
+)
+from camila.download import download
+from camila.exceptions import DownloadError, ImageError
+from camila.images import ImageService
+
+# Plans saved before they were recompressed are still PNG files
+PLAN_EXTENSIONS = ("webp", "png")
+
 
 class Plan(commands.Cog):
     """
@@ -14,28 +36,121 @@ class Plan(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        # Shared by every download, created on first use inside the running event loop
+        self._session = None
+        self.images = ImageService(workers=1, timeout=PLAN_PROCESS_TIMEOUT)
+
+        os.makedirs(PLAN_PATH, exist_ok=True)
+
+        # Group -> plan file, so !plan doesn't have to look at the disk beyond a stat of the directory
+        self.plans_mtime = os.stat(PLAN_PATH).st_mtime_ns
+        self.plans_checked = time.monotonic()
+        self.plans = self.index_plans()
+        # Group -> modification time of its plan file, to tell which plans other workers changed
+        self.plan_stamps = {group: self.stamp(path) for group, path in self.plans.items()}
+        # Group -> CDN URL of the plan, from the first time it was uploaded by !plan
+        self.plan_urls = {}
+        # Bumped on every change, so an upload of the previous plan doesn't leave its URL behind
+        self.plan_versions = collections.Counter()
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=PLAN_DOWNLOAD_TIMEOUT))
+        return self._session
+
+    def cog_unload(self):
+        if self._session is not None:
+            self.bot.loop.create_task(self._session.close())
+
+        self.images.shutdown()
+
+    @staticmethod
+    def plan_path(group: str, extension: str = PLAN_FORMAT, *, preview: bool = False) -> Path:
+        name = f"{group}.preview.{extension}" if preview else f"{group}.{extension}"
+        return Path(PLAN_PATH, name)
+
+    @staticmethod
+    def index_plans() -> dict:
+        plans = {}
+        # Earlier extensions win, like the format plans are saved in now over old PNG files
+        for extension in reversed(PLAN_EXTENSIONS):
+            for path in Path(PLAN_PATH).glob(f"*.{extension}"):
+                group = path.name[: -len(extension) - 1]
+                if not group.endswith(".preview"):
+                    plans[group] = path
+
+        return plans
+
+    @staticmethod
+    def stamp(path: Path):
+        try:
+            return path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def refresh_plans(self):
+        """Indexes the plans again once the directory changed, workers of a sharded bot share it.
+        The directory is looked at once every PLAN_REFRESH_INTERVAL seconds at most,
+        only the uploads of the plans which changed are forgotten"""
+        now = time.monotonic()
+        if now - self.plans_checked < PLAN_REFRESH_INTERVAL:
+            return
+        self.plans_checked = now
+
+        try:
+            mtime = os.stat(PLAN_PATH).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self.plans_mtime:
+            return
+
+        self.plans_mtime = mtime
+        plans = self.index_plans()
+        stamps = {group: self.stamp(path) for group, path in plans.items()}
+        for group in self.plans.keys() | plans.keys():
+            if plans.get(group) != self.plans.get(group) or stamps.get(group) != self.plan_stamps.get(group):
+                self.plan_urls.pop(group, None)
+                self.plan_versions[group] += 1
+
+        self.plans = plans
+        self.plan_stamps = stamps
 
-        os.makedirs("data/plan", exist_ok=True)
+    def get_plan_url(self, group: str):
+        url = self.plan_urls.get(group)
+        if url is None:
+            return None
+
+        # Signed CDN URLs carry their expiry as a hex timestamp
+        expires = urllib.parse.parse_qs(urllib.parse.urlparse(url).query).get("ex")
+        if expires and int(expires[0], 16) - 60 <= time.time():
+            del self.plan_urls[group]
+            return None
+
+        return url
 
     @commands.command()
     async def plan(self, ctx):
         """Display the lesson plan for the group represented by user's role"""
-        file = None
-        embed = discord.Embed()
-        for role in ctx.message.author.roles:
-            role_name = str(role).lower()
-            if os.path.isfile(f"data/plan/{role_name}.png"):
-                file = discord.File(
-                    f"data/plan/{role_name}.png", filename=f"{role_name}.png"
-                )
-                embed.set_image(url=f"attachment://{role_name}.png")
-                break
-
-        if not file:
+        self.refresh_plans()
+        group = next((name for name in (str(role).lower() for role in ctx.author.roles) if name in self.plans), None)
+        if group is None:
             await ctx.send("Żadna z twoich grup nie posiada przypisanego planu!")
             return
 
-        await ctx.send(file=file, embed=embed)
+        # After the first upload the plan is only linked from where Discord already stores it
+        url = self.get_plan_url(group)
+        if url:
+            await ctx.send(embed=discord.Embed().set_image(url=url))
+            return
+
+        path = self.plans[group]
+        version = self.plan_versions[group]
+        embed = discord.Embed().set_image(url=f"attachment://{path.name}")
+        message = await ctx.send(file=discord.File(str(path), filename=path.name), embed=embed)
+
+        if message.attachments and self.plan_versions[group] == version:
+            self.plan_urls[group] = message.attachments[0].url
 
     @commands.command()
     @commands.has_permissions(administrator=True)
@@ -52,17 +167,66 @@ class Plan(commands.Cog):
                 return
 
             plan_image = ctx.message.attachments[0]
-            if plan_image.url.endswith((".png", ".gif", ".jpg", ".jpeg")):
-                img_data = requests.get(plan_image.url).content
+            if plan_image.size > PLAN_MAX_SIZE:
+                await ctx.send(f"Plan może mieć najwyżej {PLAN_MAX_SIZE // 1024 ** 2} MB!")
+                return
 
-                with open(Path("data", "plan", f"{group}.png"), "wb") as handler:
-                    handler.write(img_data)
-                    logging.info(f"Downloaded `{plan_image.url}` as `{group}.png`")
-            else:
+            # The upload is streamed to a temporary file, the plan itself is only replaced once processed
+            upload = Path(PLAN_PATH, f"{group}.{ctx.message.id}.upload")
+            try:
+                await download(
+                    self.session,
+                    plan_image.url,
+                    str(upload),
+                    max_size=PLAN_MAX_SIZE,
+                    seconds=PLAN_DOWNLOAD_TIMEOUT,
+                )
+
+                result = await self.images.process_plan(
+                    str(upload),
+                    str(self.plan_path(group)),
+                    str(self.plan_path(group, preview=True)),
+                    fmt=PLAN_FORMAT,
+                    max_size=PLAN_MAX_RESOLUTION,
+                    preview_size=PLAN_PREVIEW_RESOLUTION,
+                    loop=self.bot.loop,
+                )
+            except DownloadError as e:
+                await ctx.send(f"Nie udało się pobrać planu: `{e}`")
+                return
+            except ImageError:
                 await ctx.send("Załącznik nie jest zdjęciem!")
                 return
+            except (asyncio.TimeoutError, BrokenProcessPool):
+                await ctx.send("Nie udało się przetworzyć planu, spróbuj ponownie.")
+                return
+            except OSError as e:
+                logging.error(f"Saving the plan of `{group}` failed: {e}")
+                await ctx.send("Nie udało się zapisać planu, spróbuj ponownie.")
+                return
+            finally:
+                if upload.exists():
+                    upload.unlink()
+
+            self.plans[group] = self.plan_path(group)
+            self.plan_stamps[group] = self.stamp(self.plans[group])
+            self.plan_urls.pop(group, None)
+            self.plan_versions[group] += 1
+
+            # A plan saved in the other format would otherwise be left behind
+            for extension in PLAN_EXTENSIONS:
+                if extension != PLAN_FORMAT:
+                    for stale in (self.plan_path(group, extension), self.plan_path(group, extension, preview=True)):
+                        if stale.exists():
+                            stale.unlink()
+
+            logging.info(
+                f"Plan of `{group}` stored as {PLAN_FORMAT}: {result['format']}, "
+                f"{plan_image.size} -> {result['size']} bytes, preview {result['preview_size']} bytes"
+            )
 
-        await ctx.send("Nowy plan ustawiony!")
+        preview = self.plan_path(group, preview=True)
+        await ctx.send("Nowy plan ustawiony!", file=discord.File(str(preview), filename=preview.name))
 
 
 def setup(bot):
@@ -0,0 +1,133 @@
+import time
+import logging
+
+import discord
+from discord.ext import commands
+
+from camila.constants import METRICS_HOST, METRICS_PORT
+from camila.metrics import MetricsServer, registry as metrics
+
+guilds = metrics.gauge("camila_guilds", "Guilds the bot is in")
+gateway_latency = metrics.gauge("camila_gateway_latency_seconds", "Latency of the gateway heartbeat")
+
+EXTRACTION_PHASES = ("index", "flat", "full", "resolve", "search", "playlist")
+
+
+def total(name: str) -> float:
+    """Sum of every child of a counter or gauge, 0 when the metric isn't registered"""
+    metric = metrics.get(name)
+    if metric is None:
+        return 0
+    return sum(child.value for child in metric.children().values())
+
+
+def milliseconds(seconds) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.0f} ms"
+
+
+class Stats(commands.Cog):
+    """
+    Metrics of the bot, served on a local port and summarized by !stats.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+
+        self.server = None
+        self.starter = None
+        # Every worker of a sharded bot serves its own metrics, on the ports following METRICS_PORT
+        self.port = None if METRICS_PORT is None else METRICS_PORT + bot.worker
+        if self.port is not None:
+            self.server = MetricsServer(metrics, METRICS_HOST, self.port)
+            self.starter = bot.loop.create_task(self.start_server())
+
+        guilds.set_function(lambda: len(self.bot.guilds))
+        gateway_latency.set_function(lambda: self.bot.latency)
+
+    def cog_unload(self):
+        if self.starter:
+            self.starter.cancel()
+        if self.server:
+            self.bot.loop.create_task(self.server.stop())
+
+        guilds.set_function(None)
+        gateway_latency.set_function(None)
+
+    async def start_server(self):
+        try:
+            await self.server.start()
+        except OSError as e:
+            # The bot works fine without the endpoint, !stats still shows the numbers
+            logging.warning(f"Metrics endpoint on {METRICS_HOST}:{self.port} failed to start: {e}")
+
+    @staticmethod
+    def uptime() -> str:
+        started = metrics.get("camila_start_time_seconds")
+        seconds = int(time.time() - started.value()) if started and started.value() else 0
+
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        days, hours = divmod(hours, 24)
+        return f"{days}d {hours}h {minutes}m {seconds}s"
+
+    @commands.command()
+    @commands.has_permissions(administrator=True)
+    async def stats(self, ctx: commands.Context):
+        """Shows the bot's metrics: commands, extraction times and music players"""
+        embed = discord.Embed(title="Statystyki")
+
+        latency = self.bot.latency
+        embed.add_field(
+            name="Bot",
+            value=f"Czas działania: {self.uptime()}\n"
+            f"Serwery: {len(self.bot.guilds)}\n"
+            f"Ping: {milliseconds(latency if latency == latency else None)}",
+            inline=False,
+        )
+
+        resources = metrics.get("camila_player_resources")
+        counts = {key[0]: child.value for key, child in resources.children().items()} if resources else {}
+        embed.add_field(
+            name="Odtwarzacze",
+            value=f"Aktywne: {counts.get('states', 0)}\n"
+            f"Procesy ffmpeg: {counts.get('processes', 0)}\n"
+            f"Utwory w kolejkach: {total('camila_queue_length'):.0f}",
+            inline=False,
+        )
+
+        command_seconds = metrics.get("camila_command_seconds")
+        if command_seconds is not None:
+            commands_run = command_seconds.total()
+            embed.add_field(
+                name="Komendy",
+                value=f"Wykonane: {commands_run.count}, błędy: {total('camila_command_errors_total'):.0f}\n"
+                f"Mediana: {milliseconds(commands_run.quantile(0.5))}, "
+                f"p95: {milliseconds(commands_run.quantile(0.95))}",
+                inline=False,
+            )
+
+        extraction_seconds = metrics.get("camila_extraction_seconds")
+        if extraction_seconds is not None:
+            lines = []
+            for phase in EXTRACTION_PHASES:
+                timings = extraction_seconds.total(phase=phase)
+                if timings.count:
+                    lines.append(
+                        f"`{phase}` {timings.count}×, średnio {milliseconds(timings.sum / timings.count)}, "
+                        f"p95 {milliseconds(timings.quantile(0.95))}"
+                    )
+
+            cache = metrics.get("camila_extraction_cache_total")
+            if cache is not None:
+                hits, misses = cache.labels("hit").value, cache.labels("miss").value
+                if hits + misses:
+                    lines.append(f"Trafienia w cache: {hits / (hits + misses):.0%}")
+
+            embed.add_field(name="Wyszukiwanie", value="\n".join(lines) or "Brak danych", inline=False)
+
+        embed.set_footer(text=f"Pełne metryki: http://{METRICS_HOST}:{self.port}/metrics")
+        await ctx.send(embed=embed)
+
+
+def setup(bot):
+    bot.add_cog(Stats(bot))
@@ -0,0 +1,29 @@
+-- Event dates become epoch seconds, so reminders can be looked up with an index range scan.
+-- The old dates were written in EVENTS_TIMEZONE, local_timestamp() reads them in that zone.
+-- Events belong to the guild they were added in, the old ones don't know it and keep a NULL guild.
+CREATE TABLE events_new
+(
+    guild_id        INTEGER,
+    creator_id      INTEGER NOT NULL,
+    event_title     TEXT NOT NULL,
+    event_date      INTEGER NOT NULL,
+    event_group     TEXT NOT NULL,
+    channel_id      INTEGER,
+    PRIMARY KEY (guild_id, event_title)
+);
+
+INSERT INTO events_new (creator_id, event_title, event_date, event_group)
+SELECT creator_id, event_title, local_timestamp(event_date), event_group
+FROM events
+WHERE local_timestamp(event_date) IS NOT NULL;
+
+-- Rows whose date can't be read are kept aside, the events cog reports them on start
+CREATE TABLE events_invalid AS
+SELECT * FROM events
+WHERE local_timestamp(event_date) IS NULL;
+
+DROP TABLE events;
+ALTER TABLE events_new RENAME TO events;
+
+CREATE INDEX events_group_date ON events (guild_id, event_group, event_date);
+CREATE INDEX events_date ON events (event_date, guild_id, event_title);
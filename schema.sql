@@ -1,7 +1,37 @@
-CREATE TABLE events
+-- Later changes to these tables are made by the scripts in migrations/
+CREATE TABLE IF NOT EXISTS events
 (
     creator_id      INTEGER NOT NULL,
     event_title     TEXT PRIMARY KEY,
     event_date      TEXT NOT NULL,
     event_group     TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS search_index
+(
+    query           TEXT PRIMARY KEY,
+    video_id        TEXT NOT NULL,
+    webpage_url     TEXT NOT NULL,
+    hits            INTEGER NOT NULL DEFAULT 0,
+    last_used       INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS search_index_last_used ON search_index (last_used);
+
+CREATE TABLE IF NOT EXISTS player_state
+(
+    guild_id            INTEGER PRIMARY KEY,
+    voice_channel_id    INTEGER NOT NULL,
+    volume              REAL NOT NULL,
+    current             TEXT,
+    position            REAL NOT NULL DEFAULT 0,
+    updated             INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS player_queue
+(
+    guild_id        INTEGER NOT NULL,
+    idx             INTEGER NOT NULL,
+    track           TEXT NOT NULL,
+    PRIMARY KEY (guild_id, idx)
 );
\ No newline at end of file
@@ -0,0 +1,185 @@
+import random
+
+import pytest
+
+from camila.indexedlist import IndexedList
+
+SIZE = 10000
+
+
+def assert_same(indexed: IndexedList, expected: list):
+    """Compares iteration, length and positional access, which goes through the Fenwick tree"""
+    assert len(indexed) == len(expected)
+    assert list(indexed) == expected
+    assert [indexed[i] for i in range(len(expected))] == expected
+    assert sum(map(len, indexed._chunks)) == len(expected)
+    assert all(indexed._chunks)
+
+
+@pytest.fixture
+def rng():
+    return random.Random(0)
+
+
+@pytest.mark.parametrize("load", [1, 4, 64])
+def test_build_and_access(load):
+    items = list(range(SIZE))
+    indexed = IndexedList(items, load=load)
+
+    assert_same(indexed, items)
+    assert indexed[-1] == items[-1]
+    assert indexed[-SIZE] == items[0]
+    with pytest.raises(IndexError):
+        indexed[SIZE]
+    with pytest.raises(IndexError):
+        indexed[-SIZE - 1]
+
+
+@pytest.mark.parametrize("load", [1, 4, 64])
+def test_append(load):
+    indexed, expected = IndexedList(load=load), []
+    for i in range(SIZE):
+        indexed.append(i)
+        expected.append(i)
+
+    assert_same(indexed, expected)
+
+
+def test_slices(rng):
+    items = list(range(SIZE))
+    indexed = IndexedList(items, load=16)
+
+    for _ in range(500):
+        start, stop = rng.randrange(-SIZE - 10, SIZE + 10), rng.randrange(-SIZE - 10, SIZE + 10)
+        step = rng.choice([None, 1, 2, 7, -1, -3])
+        assert indexed[start:stop:step] == items[start:stop:step]
+
+    assert indexed[:] == items
+    assert indexed[:3] == items[:3]
+    assert indexed[SIZE - 5 :] == items[SIZE - 5 :]
+
+
+@pytest.mark.parametrize("load", [2, 8, 64])
+def test_insert_splits_chunks(rng, load):
+    items = list(range(SIZE))
+    indexed, expected = IndexedList(items, load=load), list(items)
+
+    for i in range(SIZE):
+        index = rng.randrange(-len(expected) - 5, len(expected) + 5)
+        indexed.insert(index, -i)
+        expected.insert(index, -i)
+        if i % 1000 == 0:
+            assert_same(indexed, expected)
+
+    assert_same(indexed, expected)
+    assert max(map(len, indexed._chunks)) <= 2 * load
+
+
+def test_insert_at_the_front_of_a_chunk(rng):
+    indexed, expected = IndexedList(load=4), []
+    for i in range(SIZE):
+        indexed.insert(0, i)
+        expected.insert(0, i)
+
+    assert_same(indexed, expected)
+
+
+@pytest.mark.parametrize("load", [2, 4, 64])
+def test_pop_empties_chunks(rng, load):
+    items = list(range(SIZE))
+    indexed, expected = IndexedList(items, load=load), list(items)
+
+    while expected:
+        index = rng.randrange(-len(expected), len(expected))
+        assert indexed.pop(index) == expected.pop(index)
+        if len(expected) % 1000 == 0:
+            assert_same(indexed, expected)
+
+    assert_same(indexed, [])
+    with pytest.raises(IndexError):
+        indexed.pop()
+
+
+def test_popleft_and_delitem():
+    items = list(range(SIZE))
+    indexed, expected = IndexedList(items, load=8), list(items)
+
+    for _ in range(SIZE // 2):
+        assert indexed.popleft() == expected.pop(0)
+        del indexed[-1]
+        del expected[-1]
+
+    assert_same(indexed, expected)
+
+
+def test_move(rng):
+    items = list(range(SIZE))
+    indexed, expected = IndexedList(items, load=16), list(items)
+
+    for _ in range(SIZE):
+        source, destination = rng.randrange(len(expected)), rng.randrange(len(expected))
+        indexed.move(source, destination)
+        expected.insert(destination, expected.pop(source))
+
+    assert_same(indexed, expected)
+
+
+def test_mixed_operations_rebuild_empty_chunks(rng):
+    indexed, expected = IndexedList(load=4), []
+
+    for step in range(4 * SIZE):
+        operation = rng.random()
+        if operation < 0.4 or not expected:
+            index = rng.randrange(len(expected) + 1)
+            indexed.insert(index, step)
+            expected.insert(index, step)
+        elif operation < 0.55:
+            indexed.append(step)
+            expected.append(step)
+        elif operation < 0.85:
+            index = rng.randrange(len(expected))
+            assert indexed.pop(index) == expected.pop(index)
+        else:
+            source, destination = rng.randrange(len(expected)), rng.randrange(len(expected))
+            indexed.move(source, destination)
+            expected.insert(destination, expected.pop(source))
+
+    assert_same(indexed, expected)
+
+
+def test_shuffle_keeps_the_items():
+    random.seed(0)
+    items = list(range(SIZE))
+    indexed = IndexedList(items, load=16)
+
+    indexed.shuffle()
+
+    assert sorted(indexed) == items
+    assert list(indexed) != items
+    assert_same(indexed, list(indexed))
+
+
+def test_remove_if():
+    items = list(range(SIZE))
+    indexed = IndexedList(items, load=16)
+
+    removed = indexed.remove_if(lambda item: item % 3 == 0)
+
+    assert removed == [item for item in items if item % 3 == 0]
+    assert_same(indexed, [item for item in items if item % 3])
+    assert indexed.remove_if(lambda item: item < 0) == []
+
+    indexed.remove_if(lambda item: True)
+    assert_same(indexed, [])
+    indexed.append(1)
+    assert_same(indexed, [1])
+
+
+def test_clear():
+    indexed = IndexedList(range(SIZE))
+    indexed.clear()
+
+    assert_same(indexed, [])
+    indexed.insert(5, "a")
+    indexed.insert(0, "b")
+    assert_same(indexed, ["b", "a"])
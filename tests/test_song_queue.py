@@ -0,0 +1,193 @@
+import random
+import asyncio
+import collections
+from types import SimpleNamespace
+
+import pytest
+
+from cogs.music import SongQueue
+
+SIZE = 10000
+REQUESTERS = 10
+
+
+def fake_song(index: int) -> SimpleNamespace:
+    # Every video is queued twice, so dedupe has work to do
+    return SimpleNamespace(id=f"video{index // 2}", requester=SimpleNamespace(id=index % REQUESTERS))
+
+
+def assert_same(songs: SongQueue, expected: list):
+    assert len(songs) == len(expected)
+    assert list(songs) == expected
+    assert [songs[i] for i in range(0, len(expected), 97)] == expected[::97]
+    assert songs._ids == collections.Counter(song.id for song in expected)
+
+
+@pytest.fixture
+def loop():
+    # asyncio.Queue binds to the current loop on older Pythons
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def rng():
+    return random.Random(0)
+
+
+@pytest.fixture
+def queued(loop):
+    songs, expected = SongQueue(), []
+    for i in range(SIZE):
+        song = fake_song(i)
+        songs.put_nowait(song)
+        expected.append(song)
+    return songs, expected
+
+
+def test_put_and_get(queued):
+    songs, expected = queued
+    assert_same(songs, expected)
+
+    for _ in range(SIZE // 2):
+        assert songs.get_nowait() is expected.pop(0)
+
+    assert_same(songs, expected)
+    assert "video0" not in songs
+    assert expected[0].id in songs
+
+
+def test_get_waits_for_a_song(loop):
+    songs = SongQueue()
+    song = fake_song(0)
+
+    getter = loop.create_task(songs.get())
+    loop.call_soon(songs.put_nowait, song)
+
+    assert loop.run_until_complete(getter) is song
+    assert len(songs) == 0
+
+
+def test_remove(queued, rng):
+    songs, expected = queued
+
+    while len(expected) > SIZE // 2:
+        index = rng.randrange(-len(expected), len(expected))
+        songs.remove(index)
+        expected.pop(index)
+
+    assert_same(songs, expected)
+    with pytest.raises(IndexError):
+        songs.remove(len(expected))
+
+
+def test_move(queued, rng):
+    songs, expected = queued
+
+    for _ in range(SIZE):
+        source, destination = rng.randrange(len(expected)), rng.randrange(len(expected))
+        songs.move(source, destination)
+        expected.insert(destination, expected.pop(source))
+
+    assert_same(songs, expected)
+
+
+def test_shuffle(queued):
+    songs, expected = queued
+    random.seed(0)
+
+    songs.shuffle()
+
+    assert list(songs) != expected
+    assert sorted(map(id, songs)) == sorted(map(id, expected))
+    assert_same(songs, list(songs))
+
+
+def test_dedupe(queued):
+    songs, expected = queued
+    random.seed(0)
+    songs.shuffle()
+    shuffled = list(songs)
+
+    seen, first = set(), []
+    for song in shuffled:
+        if song.id not in seen:
+            seen.add(song.id)
+            first.append(song)
+
+    assert songs.dedupe() == SIZE // 2
+    assert_same(songs, first)
+    assert songs.dedupe() == 0
+
+
+def test_remove_requester(queued):
+    songs, expected = queued
+    member = SimpleNamespace(id=3)
+
+    assert songs.remove_requester(member) == SIZE // REQUESTERS
+    assert_same(songs, [song for song in expected if song.requester.id != 3])
+    assert songs.remove_requester(member) == 0
+
+
+def test_remove_everything_and_refill(queued):
+    songs, expected = queued
+
+    assert songs.remove_where(lambda song: True) == SIZE
+    assert_same(songs, [])
+    assert songs.empty()
+
+    refill = [fake_song(i) for i in range(100)]
+    for song in refill:
+        songs.put_nowait(song)
+    assert_same(songs, refill)
+
+    songs.clear()
+    assert_same(songs, [])
+
+
+def test_mixed_operations(loop, rng):
+    songs, expected = SongQueue(), []
+
+    for step in range(4 * SIZE):
+        operation = rng.random()
+        if operation < 0.45 or not expected:
+            song = fake_song(rng.randrange(SIZE))
+            songs.put_nowait(song)
+            expected.append(song)
+        elif operation < 0.6:
+            assert songs.get_nowait() is expected.pop(0)
+        elif operation < 0.8:
+            index = rng.randrange(len(expected))
+            songs.remove(index)
+            expected.pop(index)
+        elif operation < 0.999:
+            source, destination = rng.randrange(len(expected)), rng.randrange(len(expected))
+            songs.move(source, destination)
+            expected.insert(destination, expected.pop(source))
+        else:
+            requester = rng.randrange(REQUESTERS)
+            removed = songs.remove_where(lambda song: song.requester.id == requester)
+            kept = [song for song in expected if song.requester.id != requester]
+            assert removed == len(expected) - len(kept)
+            expected = kept
+
+    assert_same(songs, expected)
+
+
+def test_changes_are_signalled(queued):
+    songs, expected = queued
+    version = songs.version
+    songs.changed.clear()
+
+    songs.move(0, 5)
+
+    assert songs.version == version + 1
+    assert songs.changed.is_set()
+
+    songs.changed.clear()
+    assert songs.remove_where(lambda song: False) == 0
+    assert songs.dedupe() > 0
+    assert songs.changed.is_set()
+    assert songs.version == version + 2